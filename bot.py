@@ -7,46 +7,8 @@ from disnake.ext import commands
 from cogs.utils.database import ORM
 import sentry_sdk
 
-# Logger Setup
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "--log-level",
-    default="info",
-    help=(
-        "Provide logging level. "
-        "Example --log debug', default='info'"
-    ),
-)
-
-options = parser.parse_args()
-levels = {
-    'critical': logging.CRITICAL,
-    'error': logging.ERROR,
-    'warn': logging.WARNING,
-    'warning': logging.WARNING,
-    'info': logging.INFO,
-    'debug': logging.DEBUG
-}
-level = levels.get(options.log_level.lower())
-if level is None:
-    raise ValueError(
-        f"log level given: {options.log_level}"
-        f" -- must be one of: {' | '.join(levels.keys())}")
-
-logging.basicConfig(level=level, format='%(asctime)s %(levelname)s [%(name)s]: %(message)s')
 logger = logging.getLogger('bot')
 
-sentry_dsn = sec.load('sentry_dsn')
-if sentry_dsn:
-    logger.info('Sentry DSN found, initializing Sentry SDK.')
-    sentry_sdk.init(
-        dsn=sentry_dsn,
-
-        # Set traces_sample_rate to 1.0 to capture 100%
-        # of transactions for performance monitoring.
-        # We recommend adjusting this value in production.
-        traces_sample_rate=1.0
-    )
 
 class DevTracker(commands.InteractionBot):
 
@@ -68,14 +30,60 @@ class DevTracker(commands.InteractionBot):
         self.load_extension("cogs.admin")
         self.load_extension("cogs.tracker")
 
+    async def close(self):
+        await super().close()
+        await ORM().close_connection()
+
+
+# Render pool workers import this module too, see renderer.start()
+if __name__ == '__main__':
+    # Logger Setup
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--log-level",
+        default="info",
+        help=(
+            "Provide logging level. "
+            "Example --log debug', default='info'"
+        ),
+    )
 
-DT = DevTracker()
-
-init_db_tack = DT.loop.create_task(ORM().initialize())
-DT.loop.run_until_complete(init_db_tack)
-
-token = sec.load('bot_token')
-if logger.getEffectiveLevel() == logging.DEBUG:
-    token = sec.load('debug_bot_token')
-
-DT.run(token)
+    options = parser.parse_args()
+    levels = {
+        'critical': logging.CRITICAL,
+        'error': logging.ERROR,
+        'warn': logging.WARNING,
+        'warning': logging.WARNING,
+        'info': logging.INFO,
+        'debug': logging.DEBUG
+    }
+    level = levels.get(options.log_level.lower())
+    if level is None:
+        raise ValueError(
+            f"log level given: {options.log_level}"
+            f" -- must be one of: {' | '.join(levels.keys())}")
+
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s [%(name)s]: %(message)s')
+
+    sentry_dsn = sec.load('sentry_dsn')
+    if sentry_dsn:
+        logger.info('Sentry DSN found, initializing Sentry SDK.')
+        sentry_sdk.init(
+            dsn=sentry_dsn,
+
+            # Set traces_sample_rate to 1.0 to capture 100%
+            # of transactions for performance monitoring.
+            # We recommend adjusting this value in production.
+            traces_sample_rate=1.0
+        )
+
+    DT = DevTracker()
+
+    init_db_tack = DT.loop.create_task(ORM().initialize())
+    DT.loop.run_until_complete(init_db_tack)
+
+    token = sec.load('bot_token')
+    if logger.getEffectiveLevel() == logging.DEBUG:
+        token = sec.load('debug_bot_token')
+
+    DT.run(token)
@@ -7,6 +7,7 @@ from cogs.utils import autocompleters as ac
 
 from cogs.utils import database as db
 from cogs.utils import api
+from cogs.utils import renderer
 ORM = db.ORM()
 API = api.API()
 
@@ -56,6 +57,16 @@ class Admin(commands.Cog):
         emb.add_field(name='Bot Latency', value=f"{round(self.bot.latency * 1000)}ms", inline=True)
         emb.add_field(name=api_status, value=api_latency, inline=True)
 
+        breakers = API.get_breakers_status()
+        breakers_md = ''
+        for gid, status in breakers.items():
+            breakers_md += f"`{gid}` - {status['state']} ({status['failures']} failures, retry in {status['retry_in']}s)\n"
+        emb.add_field(name='🚧 Failing Feeds', value=breakers_md[:1024] or 'None', inline=False)
+
+        cache = renderer.CACHE.stats()
+        cache_md = f"{cache['hits']} hits / {cache['misses']} misses - {cache['entries']} posts ({round(cache['size'] / 1024)} KiB)"
+        emb.add_field(name='🖼️ Render Cache', value=cache_md, inline=False)
+
         await inter.edit_original_message(embed=emb)
 
 
@@ -2,16 +2,14 @@ import asyncio
 from collections import defaultdict
 import logging
 import random
-import re
 
-from bs4 import BeautifulSoup, NavigableString
+from bs4 import BeautifulSoup
 import disnake
 from disnake.ext import tasks, commands
 
 from cogs.utils.services import CUSTOMIZERS
-from cogs.utils.emojimapper import EmojiMapper
 from cogs.utils import autocompleters as ac
-from cogs.utils import mardownify_discord as md
+from cogs.utils import renderer
 from cogs.utils import database as db
 from cogs.utils import api
 ORM = db.ORM()
@@ -19,7 +17,6 @@ API = api.API()
 
 
 # Enforced by the Discord API
-EMBEDS_MAX_DESC = 4096
 EMBEDS_MAX_TOTAL = 6000
 EMBEDS_MAX_AMOUNT = 10
 
@@ -59,14 +56,23 @@ class Tracker(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.EM = EmojiMapper()
+        renderer.start()
+        # Resolved routes and the ORM snapshot they were built from, see _get_routes()
+        self._routes = None
+        self._routes_source = None
         self.reset_bot_state.start()
         self.resfresh_posts.start()
+        self.warm_posts_state.start()
+        self.maintain_db.start()
         logger.info("Loaded.")
 
     def cog_unload(self):
         self.reset_bot_state.cancel()
         self.resfresh_posts.cancel()
+        self.warm_posts_state.cancel()
+        self.maintain_db.cancel()
+        self.bot.loop.create_task(API.close())
+        renderer.shutdown()
         logger.info('Unloaded.')
 
     # ---------------------------------------------------------------------------------
@@ -104,6 +110,32 @@ class Tracker(commands.Cog):
             logger.info(f"Removed {len(removed_guilds_from_db)} guilds from database. [{removed_guilds_from_db}]")
 
             logger.info("Pruning guilds done.")
+
+    # Resolved routes hold channel objects, they must follow Discord changes
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: disnake.Guild):
+        self._routes = None
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: disnake.Guild):
+        self._routes = None
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild: disnake.Guild):
+        self._routes = None
+
+    @commands.Cog.listener()
+    async def on_guild_unavailable(self, guild: disnake.Guild):
+        self._routes = None
+
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel: disnake.abc.GuildChannel):
+        self._routes = None
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: disnake.abc.GuildChannel):
+        self._routes = None
+
     # ---------------------------------------------------------------------------------
     # TASKS
     # ---------------------------------------------------------------------------------
@@ -120,110 +152,124 @@ class Tracker(commands.Cog):
 
     @tasks.loop(seconds=30)
     async def resfresh_posts(self):
+        try:
+            await self._refresh_posts()
+        finally:
+            # Every tick persists the buffered last posts, quiet ones included,
+            # as follow commands buffer them too
+            await ORM.flush_last_posts()
+
+    async def _refresh_posts(self):
 
         logger.debug('Refreshing posts.')
-        posts_per_gid = await self._fetch_posts()
-        ordered_fws = await self._fetch_fw()
+        # Only followed games are polled, the others are kept warm by `warm_posts_state`
+        fw_game_ids = set((await ORM.get_routes()).keys())
 
         api_games_dict = await API.fetch_available_games()
-        fw_game_ids = await ORM.get_all_followed_games()
         local_games = await ORM.get_local_games()
 
         if len(api_games_dict.keys()) > len(local_games):
             # No need to reread, next loop will do it
             await ORM.update_local_games(api_games_dict)
 
-        game_ids = [g[0] for g in local_games]
-
-        guild = None
-        target_channel = None
-        default_channel_id = None
+        if not fw_game_ids:
+            logger.debug('Refresh task completed, no game followed.')
+            return
 
-        all_ignored_accounts = await ORM.get_all_ignored_accounts_per_guild()
-        all_ignored_services = await ORM.get_all_ignored_services()
+        posts_per_gid = await self._fetch_posts(fw_game_ids, conditional=True)
 
-        all_allowed_accounts = await ORM.get_all_allowed_accounts_per_guild()
-        all_allowed_services = await ORM.get_all_allowed_services()
+        game_ids = [g[0] for g in local_games]
 
         if not posts_per_gid:
             logger.error("API didnt returned anything !")
             return
 
-        saved_post_ids_per_game = await ORM.get_saved_post_ids()
-        if not saved_post_ids_per_game:
+        # Quiet tick, every feed is unchanged or failed
+        if not any(isinstance(feed, api.PostsFeed) for feed in posts_per_gid.values()):
+            logger.debug('Refresh task completed, no feed modified.')
+            return
+
+        watermark_mode = db.POSTS_STATE == 'watermark'
+        if watermark_mode:
+            saved_state_per_game = await ORM.get_watermarks()
+        else:
+            modified_game_ids = [gid for gid, feed in posts_per_gid.items() if isinstance(feed, api.PostsFeed)]
+            saved_state_per_game = await ORM.get_saved_post_ids(modified_game_ids)
+        if not saved_state_per_game:
             logger.error("No saved post_ids detected ! Please init them with /dt-save-posts")
+            # Feeds weren't processed, they must be downloaded again next time
+            API.reset_validators()
             return
 
         if not game_ids:
             logger.error("No games found !")
+            API.reset_validators()
             return
 
         embeds_per_gid = defaultdict(list)
+        latest_post_id_per_gid = {}
+        watermarks_updates = {}
+        posts_to_render = []
 
         for gid in game_ids:
+            if gid not in fw_game_ids:
+                continue
+
+            if posts_per_gid.get(gid) == api.NOT_MODIFIED:
+                logger.debug(f'{gid}: Feed not modified.')
+                continue
+
             if gid not in posts_per_gid.keys() or not posts_per_gid[gid]:
                 logger.warning(f"{gid} is in the available games but no posts were found.")
                 continue
 
-            ordered_posts = sorted(posts_per_gid[gid], key=lambda p: p['timestamp'], reverse=True)
-
-            current_post_ids = set([p['id'] for p in posts_per_gid[gid]])
-            saved_post_ids = set(saved_post_ids_per_game[gid])
-            new_post_ids = current_post_ids.difference(saved_post_ids)
+            feed = posts_per_gid[gid]
+            if not watermark_mode:
+                new_post_ids = set(feed.ids).difference(saved_state_per_game[gid])
+            elif gid in saved_state_per_game:
+                floor_timestamp, recent_post_ids = saved_state_per_game[gid]
+                new_post_ids = {
+                    post_id for post_id, ts in feed.timestamps.items()
+                    if ts > floor_timestamp and post_id not in recent_post_ids
+                }
+                watermarks_updates[gid] = {post_id: feed.timestamps[post_id] for post_id in new_post_ids}
+            else:
+                # Never seen before, its current posts aren't new
+                logger.info(f'{gid}: No watermark found, initializing it.')
+                watermarks_updates[gid] = feed.timestamps
+                new_post_ids = set()
 
             if not new_post_ids:
                 logger.debug(f'{gid}: No new posts detected.')
+                feed.release()
             else:
                 logger.info(f"{gid}: New posts detected ({new_post_ids}).")
-                new_posts = list(filter(lambda p: p['id'] in new_post_ids, ordered_posts))
+                # Only new posts are kept
+                new_posts = posts_per_gid[gid].get_posts(new_post_ids)
+                latest_post_id_per_gid[gid] = new_posts[0]['id']
 
                 for post in new_posts:
-                    if gid not in fw_game_ids:
-                        # logger.info(f"Ignoring {gid} because it isnt followed by anyone.")
-                        continue
-
                     logger.info(f"Processing: [{gid}] {post['account']['identifier']} | {post['topic']} [{post['id']}] ")
-                    em = self._generate_embed(post)
-                    embeds_per_gid[gid].append((em, post['account']['identifier'], post['account']['service']))
+                    posts_to_render.append((gid, post))
 
-        message_queue = []
-        for last_post_id, channel_id, guild_id, game_id in ordered_fws:
-            if not guild or guild.id != guild_id:
-                default_channel_id = await ORM.get_main_channel(guild_id)
-                guild = self.bot.get_guild(guild_id)
+        # Every new post of the tick is rendered at once, in parallel
+        embeds = await asyncio.gather(*[self._generate_embed(post) for _, post in posts_to_render])
+        for (gid, post), em in zip(posts_to_render, embeds):
+            embeds_per_gid[gid].append((em, post['account']['identifier'], post['account']['service']))
 
-            # Means the bot lost permissions for some reasons
-            if not guild:
-                logger.warning(f'{guild_id} cant be found in the discord API ! Removing it from the DB.')
-                await ORM.rm_guild(guild_id)
-                await ORM.rm_follow(guild_id)
-                continue
-
-            thread_filters = await ORM.get_urlfilters_thread(guild_id, game_id)
-            if channel_id:
-                target_channel = guild.get_channel(channel_id)
-            elif default_channel_id:
-                target_channel = guild.get_channel(default_channel_id)
-            elif len(thread_filters) > 0:
-                logger.debug(f'{guild.name} [{guild.id}] follows {game_id} hasnt set any channel but have some thread filters')
-            else:
-                logger.debug(f'{guild.name} [{guild.id}] follows {game_id} but hasnt set any channel')
-
-                # We can see the owner only if we have the Members privileged intent
-                if not guild.owner_id:
-                    continue
-
-                continue
-
-            if game_id not in embeds_per_gid.keys():
-                logger.debug(f'No new posts for {game_id}.')
-                continue
+        if not embeds_per_gid:
+            if watermark_mode:
+                await ORM.update_watermarks(watermarks_updates)
+            logger.debug('Refresh task completed, no new posts.')
+            return
 
-            if not target_channel and not thread_filters:
-                logger.warning(f'Could not find a proper channel [{channel_id} | {default_channel_id} | {thread_filters}].')
-                continue
+        all_ignored_accounts, all_ignored_services, all_allowed_accounts, all_allowed_services = await ORM.get_filters()
 
-            url_filters_per_service = await ORM.get_urlfilters_per_service(guild_id, game_id)
+        message_queue = []
+        routes = await self._get_routes()
+        subscribers = [sub for gid in embeds_per_gid.keys() for sub in routes.get(gid, [])]
+        for game_id, guild, target_channel, url_filters_per_service in subscribers:
+            guild_id = guild.id
 
             messages_per_channel = defaultdict(list)
             embeds = []
@@ -236,7 +282,7 @@ class Tracker(commands.Cog):
                     continue
 
                 if service_id in url_filters_per_service.keys():
-                    filter_result = self._apply_urlfilters(guild, url_filters_per_service[service_id], em.fields[0].value)
+                    filter_result = self._match_urlfilters(guild, url_filters_per_service[service_id], em.fields[0].value)
 
                     # Only send message if filters are matched if no channel_id
                     if filter_result == 'skip_post':
@@ -296,7 +342,7 @@ class Tracker(commands.Cog):
             for channel, messages in messages_per_channel.items():
 
                 if channel:
-                    message_queue.append((channel, messages, ordered_posts[-1]['id']))
+                    message_queue.append((channel, messages, latest_post_id_per_gid[game_id]))
                     logger.debug(f"{guild_id}/{game_id}: {len(messages)} messages to send.")
                 else:
                     logger.warning(f"{guild_id}/{game_id}: {len(messages)} messages to send but no channel found.")
@@ -307,17 +353,41 @@ class Tracker(commands.Cog):
                 for channel, messages, latest_post_id in message_queue
             ],
         )
+        await ORM.flush_last_posts()
 
-        if embeds_per_gid:
+        if watermark_mode:
+            await ORM.update_watermarks(watermarks_updates)
+        elif embeds_per_gid:
             logger.info(f"Updating posts state for {embeds_per_gid.keys()}")
-            await asyncio.gather(
-                *[
-                    ORM.set_saved_post_ids(gid, [p['id'] for p in posts_per_gid[gid]])
-                    for gid in embeds_per_gid.keys()
-                ],
-            )
+            await ORM.update_saved_post_ids({gid: posts_per_gid[gid].ids for gid in embeds_per_gid.keys()})
         logger.debug('Refresh task completed.')
 
+    @tasks.loop(minutes=10)
+    async def warm_posts_state(self):
+        """ Keep the posts state of unfollowed games fresh, so following
+        one of them doesn't replay its history as new posts.
+        """
+        games = await API.fetch_available_games()
+        fw_game_ids = await ORM.get_all_followed_games()
+        unfollowed_game_ids = [gid for gid in games.values() if gid not in fw_game_ids]
+        if not unfollowed_game_ids:
+            return
+
+        posts_per_gid = await self._fetch_posts(unfollowed_game_ids, conditional=True)
+        await self._save_posts_state({
+            gid: posts
+            for gid, posts in posts_per_gid.items()
+            if posts != api.NOT_MODIFIED
+        })
+
+        logger.debug(f'Posts state warmed for {len(posts_per_gid)} unfollowed games.')
+
+    @tasks.loop(hours=6)
+    async def maintain_db(self):
+        logger.info("Database maintenance started.")
+        await ORM.maintenance()
+        logger.info("Database maintenance done.")
+
     async def _send_embeds(self, channel_or_thread, messages, last_post_id):
 
         await asyncio.sleep(random.randint(1, 10))  # Avoid rate limits
@@ -371,6 +441,18 @@ class Tracker(commands.Cog):
         await self.bot.wait_until_ready()
         logger.info(f'Bot ready, launching refresh task. (Loop every {self.resfresh_posts.seconds} seconds)')
 
+    @warm_posts_state.before_loop
+    async def before_warm(self):
+        logger.info('Waiting before launching warm task...')
+        await self.bot.wait_until_ready()
+        logger.info(f'Bot ready, launching warm task. (Loop every {self.warm_posts_state.minutes} minutes)')
+
+    @maintain_db.before_loop
+    async def before_maintain_db(self):
+        logger.info('Waiting before launching database maintenance task...')
+        await self.bot.wait_until_ready()
+        logger.info(f'Bot ready, launching database maintenance task. (Loop every {self.maintain_db.hours} hours)')
+
     # ---------------------------------------------------------------------------------
     # APPLICATION COMMANDS
     # ---------------------------------------------------------------------------------
@@ -585,9 +667,8 @@ class Tracker(commands.Cog):
             return
         else:
             game_id = games[game_name]
-            accounts = await API.fetch_accounts(game_id)
-            account_ids = [a["identifier"] for a in accounts]
-            if account_id not in account_ids:
+            accounts_index = await API.get_accounts_index(game_id)
+            if not accounts_index or account_id not in accounts_index.by_identifier:
                 emb_err.title = "❌ Account Error"
                 emb_err.description = f"`{account_id}` doesn't exists or isn't followed for `{game_name}`."
                 await inter.edit_original_message(embed=emb_err)
@@ -738,9 +819,8 @@ class Tracker(commands.Cog):
             return
         else:
             game_id = games[game_name]
-            accounts = await API.fetch_accounts(game_id)
-            account_ids = [a['identifier'] for a in accounts if a['service'] == service_id]
-            if account_id not in account_ids:
+            accounts_index = await API.get_accounts_index(game_id)
+            if not accounts_index or account_id not in accounts_index.by_service.get(service_id, []):
                 emb_err.title = "❌ Account Error"
                 emb_err.description = f"`{account_id}` doesn't exists or isn't followed for `{game_name}`."
                 await inter.edit_original_message(embed=emb_err)
@@ -1213,12 +1293,9 @@ class Tracker(commands.Cog):
                 emb_error.description = f"`{post_id}` not found."
                 await inter.edit_original_message(embed=emb_error)
             else:
-                em = self._generate_embed(post[0])
+                em = await self._generate_embed(post[0])
 
-                all_ignored_accounts = await ORM.get_all_ignored_accounts_per_guild()
-                all_ignored_services = await ORM.get_all_ignored_services()
-                all_allowed_accounts = await ORM.get_all_allowed_accounts_per_guild()
-                all_allowed_services = await ORM.get_all_allowed_services()
+                all_ignored_accounts, all_ignored_services, all_allowed_accounts, all_allowed_services = await ORM.get_filters()
 
                 should_skip = self._should_skip(
                     inter.guild_id,
@@ -1251,10 +1328,9 @@ class Tracker(commands.Cog):
             return 'error'
 
         for game_id, posts in posts_per_game.items():
-            post_ids = [p['id'] for p in posts]
             logger.info(f"{game_id}: Updating posts state.")
-            logger.debug(post_ids)
-            await ORM.set_saved_post_ids(game_id, post_ids)
+            logger.debug(posts.ids)
+        await self._save_posts_state(posts_per_game)
 
         logger.info("The bot state has been reset.")
         return 'success'
@@ -1284,10 +1360,14 @@ class Tracker(commands.Cog):
         await inter.response.defer()
         games = await API.fetch_available_games()
         gid = games[game_name]
-        saved_post_ids = await ORM.get_saved_post_ids()
+        if db.POSTS_STATE == 'watermark':
+            watermarks = await ORM.get_watermarks()
+            saved_post_ids = {game_id: recent_post_ids for game_id, (_, recent_post_ids) in watermarks.items()}
+        else:
+            saved_post_ids = await ORM.get_saved_post_ids([gid])
 
         msg = '```\n'
-        for post_id in saved_post_ids[gid]:
+        for post_id in saved_post_ids.get(gid, []):
             msg += f'{post_id}\n'
         msg += '```'
 
@@ -1299,6 +1379,14 @@ class Tracker(commands.Cog):
     # HELPERS
     # ---------------------------------------------------------------------------------
 
+    async def _save_posts_state(self, posts_per_game):
+        """ Remember every current post of each game as already seen.
+        """
+        if db.POSTS_STATE == 'watermark':
+            await ORM.update_watermarks({gid: posts.timestamps for gid, posts in posts_per_game.items()})
+        else:
+            await ORM.update_saved_post_ids({gid: posts.ids for gid, posts in posts_per_game.items()})
+
     async def _fetch_last_post(self, game_id, channel: disnake.abc.GuildChannel, guild: disnake.Guild):
 
         post = await API.fetch_latest_post(game_id)
@@ -1307,7 +1395,7 @@ class Tracker(commands.Cog):
             logger.error('API didnt returned anything !')
             return
 
-        em = self._generate_embed(post)
+        em = await self._generate_embed(post)
         post_id = post['id']
         if isinstance(channel, disnake.TextChannel):
             logger.info(f'{guild.name} [{guild.id}] : Fetching {post_id} for "{game_id}". (Dest: `#{channel.name}`)')
@@ -1321,18 +1409,66 @@ class Tracker(commands.Cog):
         else:
             logger.error(f'{guild.name} [{guild.id}] : Cannot send message in #{channel} (not a TextChannel). last_post not updated.')
 
-    async def _fetch_fw(self):
-        follows = await ORM.get_all_follows()
+    async def _get_routes(self):
+        """ Subscribers of each game, as `{game_id: [(game_id, guild, target_channel, compiled_url_filters_per_service)]}`.
 
-        # Minimize calls on DBs/Disnake per guilds
-        logger.debug(f'{len(follows)} follows retrieved.')
-        return sorted(follows, key=lambda fw: fw[2])
+        Built from the ORM routes snapshot and resolved against the Discord cache, it's rebuilt
+        when the snapshot is invalidated or when guilds/channels change on Discord.
+        """
+        routes = await ORM.get_routes()
+        if self._routes is not None and self._routes_source is routes:
+            return self._routes
 
-    async def _fetch_posts(self):
-        games = await API.fetch_available_games()
-        game_ids = [gid for gid in games.values()]
+        resolved = defaultdict(list)
+        missing_guild_ids = set()
+        for game_id, follows in routes.items():
+            for guild_id, channel_id, main_channel_id, thread_filters, url_filters_per_service in follows:
+                guild = self.bot.get_guild(guild_id)
+
+                # Means the bot lost permissions for some reasons
+                if not guild:
+                    missing_guild_ids.add(guild_id)
+                    continue
+
+                target_channel = None
+                if channel_id:
+                    target_channel = guild.get_channel(channel_id)
+                elif main_channel_id:
+                    target_channel = guild.get_channel(main_channel_id)
+                elif len(thread_filters) > 0:
+                    logger.debug(f'{guild.name} [{guild.id}] follows {game_id} hasnt set any channel but have some thread filters')
+                else:
+                    logger.debug(f'{guild.name} [{guild.id}] follows {game_id} but hasnt set any channel')
+                    continue
+
+                if not target_channel and not thread_filters:
+                    logger.warning(f'Could not find a proper channel [{channel_id} | {main_channel_id} | {thread_filters}].')
+                    continue
+
+                compiled_url_filters = {
+                    service_id: self._compile_urlfilters(url_filters)
+                    for service_id, url_filters in url_filters_per_service.items()
+                }
+                resolved[game_id].append((game_id, guild, target_channel, compiled_url_filters))
+
+        self._routes = resolved
+        self._routes_source = routes
+        logger.debug(f'Routes resolved for {len(resolved)} games.')
+
+        for guild_id in missing_guild_ids:
+            logger.warning(f'{guild_id} cant be found in the discord API ! Removing it from the DB.')
+            await ORM.rm_guild(guild_id)
+            await ORM.rm_follow(guild_id)
+
+        return resolved
+
+    async def _fetch_posts(self, game_ids=None, conditional=False):
+        if game_ids is None:
+            games = await API.fetch_available_games()
+            game_ids = [gid for gid in games.values()]
         nb_posts = 0
-        res = await API.fetch_all_posts(game_ids)
+        nb_not_modified = 0
+        res = await API.fetch_all_posts(game_ids, conditional=conditional)
 
         posts = {}
         for r in res:
@@ -1340,8 +1476,10 @@ class Tracker(commands.Cog):
 
         errors = defaultdict(list)
         for gid, g_res in posts.items():
-            if isinstance(g_res, list):
+            if isinstance(g_res, api.PostsFeed):
                 nb_posts += len(posts[gid])
+            elif g_res == api.NOT_MODIFIED:
+                nb_not_modified += 1
             else:
                 errors[g_res].append(gid)
         err_stats = ''
@@ -1351,197 +1489,10 @@ class Tracker(commands.Cog):
                 posts.pop(gid)
 
         err_msg = err_stats if err_stats else 'No errors'
-        logger.info(f'{nb_posts} posts retrieved ({err_msg}).')
+        logger.info(f'{nb_posts} posts retrieved, {nb_not_modified} feeds not modified ({err_msg}).')
         return posts
 
-    def _find_img(self, soup: BeautifulSoup):
-        imgs = soup.find_all('img')
-
-        if not imgs:
-            return None
-
-        # Last img first
-        imgs.reverse()
-        for img in imgs:
-            if 'src' not in img:
-                # I don't even know how it happens but it happens
-                continue
-            if 'icon' in img['src'] and '.gif' in img['src']:
-                # Some services use old .gif emojis, in the future it would probably
-                # be better to check for a minimal size.
-                continue
-            else:
-                # Force HTTPS url scheme
-                return re.sub(r"^\/\/", 'https://', img['src'])
-        return None
-
-    def _sanitize_post_content(self, post_content, origin=None, strip_blockquotes=False):
-
-        if origin not in ['Twitter', ]:
-            post_content = post_content.replace('\n', '')
-
-        # Fix Missing emojis
-        post_content = self.EM._replace_emoji_shortcodes(post_content)
-
-        soup = BeautifulSoup(post_content, "html.parser")
-        nb_char_overflow = len(soup.prettify()) - EMBEDS_MAX_DESC
-
-        if strip_blockquotes and nb_char_overflow > 0:
-            for blockquote in soup.find_all('blockquote'):
-                blockquote.decompose()
-
-        # Fix links from CommLink
-        if origin in ['CommLink']:
-            for a in soup.find_all('a'):
-                has_u = False
-                has_i = False
-                has_b = False
-                if a.has_attr('href') and a['href'].startswith('\"'):
-                    a['href'] = a['href'][1:-1]
-
-                if a.text:
-                    backup_txt = a.get_text()
-                    for t in a.children:
-                        if t.name == 'u':
-                            t.decompose()
-                            has_u = True
-                        if t.name == 'i':
-                            t.decompose()
-                            has_i = True
-                        if t.name == 'b' or t.name == 'strong':
-                            t.decompose()
-                            has_b = True
-                        a.string = backup_txt
-
-                if has_u:
-                    nt = soup.new_tag("u")
-                    c = a.replace_with(nt)
-                    nt.append(c)
-                if has_i:
-                    nt = soup.new_tag("i")
-                    c = a.replace_with(nt)
-                    nt.append(c)
-                if has_b:
-                    nt = soup.new_tag("b")
-                    c = a.replace_with(nt)
-                    nt.append(c)
-
-
-        # Fix blockquote from Spectrum
-        if origin in ['rsi', 'Bungie.net']:
-            for quoteauthor in soup.find_all('div', {'class': 'quoteauthor'}):
-                quoteauthor.insert_after(soup.new_tag("br"))
-                quoteauthor.insert_after(soup.new_tag("br"))
-
-        # Fix blockquote from Reddit
-        if origin in ['Reddit', 'Steam']:
-            for quoteauthor in soup.find_all('div', {'class': 'bb_quoteauthor'}):
-                quoteauthor.insert_after(soup.new_tag("br"))
-                quoteauthor.insert_after(soup.new_tag("br"))
-
-        # Fix blockquote from Twitter
-        if origin == 'Twitter':
-            for quoteblock in soup.find_all('blockquote'):
-                quoteauthor = quoteblock.next_element
-                quoteauthor.insert_after(soup.new_tag("br"))
-                quoteauthor.insert_after(soup.new_tag("br"))
-                quoteauthor.insert_before("Originally posted by ")
-
-        # Ellipsising Blocquotes
-        bqs = soup.find_all('blockquote')
-        if nb_char_overflow > 0:
-            i = 0
-            bqs = soup.find_all('blockquote')
-            nb_char_stripped = 0
-            last_processed_bq = False
-
-            nb_blocquotes = len(bqs)
-            # We try to remove the less text possible, ellipsising is interrupted as soon as we can
-            while i < nb_blocquotes and nb_char_overflow > nb_char_stripped:
-                bq = bqs[i]
-                init_bq_size = len(bq.text)
-                bq_ps = bq.findAll('p')
-
-                if len(bq_ps) < 2:
-
-                    # Prevent useless loop
-                    if len(bqs) < 1:
-                        nb_blocquotes = 0
-                        break
-
-                    if bqs[-1].string == '[...]':
-                        bqs[-1].decompose()
-                        nb_blocquotes -= 1
-                        nb_char_stripped += 5
-                        logger.debug(f"{nb_char_stripped} chars stripped.")
-                        bqs = soup.find_all('blockquote')
-                        nb_blocquotes = len(bqs)
-                    elif len(bqs) > 1:
-                        ellipsis = soup.new_tag('blockquote')
-                        ellipsis.string = '[...]'
-                        nb_char_stripped += len(bqs[-1].text) - 5
-                        bqs[-1].decompose()
-                        bqs[-2].insert_after(ellipsis)
-                        logger.debug(f"{nb_char_stripped} chars stripped.")
-                        bqs = soup.find_all('blockquote')
-                        nb_blocquotes = len(bqs)
-                    elif len(bqs) == 1:
-                        nb_char_stripped += len(bqs[-1].text)
-                        bqs[-1].decompose()
-                        bqs = soup.find_all('blockquote')
-                        nb_blocquotes = 0
-                        break
-                    else:
-                        logger.error("Useless stripping loop !")
-                        break
-
-                    continue
-
-                ellipsis = soup.new_tag('p')
-                ellipsis.string = '[...]'
-                bq_ps[-1].decompose()
-                bq_ps[-2].insert_after(ellipsis)
-                if len(bq_ps) > 2:
-                    # Delete last two nodes and reinsert ellipsis
-                    bq_ps[-1].decompose()
-                    bq_ps[-2].decompose()
-                    bq_ps[-3].insert_after(ellipsis)
-                    nb_char_stripped += init_bq_size - len(bq.text)
-                    last_processed_bq = bq
-                else:
-                    i += 1
-                    continue
-
-            # Ensure Ellipsis
-            if last_processed_bq:
-                last_p = last_processed_bq.findAll('p')[-1]
-                if last_p.text != '[...]':
-                    if last_p.string:
-                        last_p.string.replace_with('[...]')
-                    else:
-                        last_p.append(NavigableString('[...]'))
-
-                logger.debug(str(nb_char_stripped) + ' characters stripped from blockquotes')
-
-        # HTML -> Markdown
-        body = md.markdownify(soup, bullets="-", strip=["img"])
-
-        # Max 2 new lines in a row
-        body_trimmed = re.sub(r'\n\s*\n', '\n\n', body)
-
-        # For blocquotes too
-        # There's probably a simpler way to do this, but I'm too tired to fight with regex :D
-        while re.search(r'\n>\s*\n>\s*\n>\s*\n>', body_trimmed, re.MULTILINE):
-            body_trimmed = re.sub(r'\n>\s*\n>\s*\n>\s*\n>', '\n> \n> ', body_trimmed)
-        body_trimmed = re.sub(r'\n>\s*\n>\s*\n>', '\n> \n> ', body_trimmed)
-
-        description = (body_trimmed[:EMBEDS_MAX_DESC - 15] + '...\n\n[...]') if len(body_trimmed) > EMBEDS_MAX_DESC else body_trimmed
-
-        img_url = self._find_img(soup)
-
-        return description, img_url
-
-    def _generate_embed(self, post):
+    async def _generate_embed(self, post):
 
         service = post['account']['service']
 
@@ -1550,7 +1501,7 @@ class Tracker(commands.Cog):
         if post['topicUrl']:
             strip_blockquotes = 'https://robertsspaceindustries.com/spectrum/community/SC/forum/190048/thread/' in post['topicUrl']
 
-        description, img_url = self._sanitize_post_content(post['content'], origin=service, strip_blockquotes=strip_blockquotes)
+        description, img_url = await renderer.render(post['id'], post['content'], origin=service, strip_blockquotes=strip_blockquotes)
 
         color = CUSTOMIZERS['default']['color']
         author_icon_url = CUSTOMIZERS['default']['icon_url']
@@ -1613,26 +1564,34 @@ class Tracker(commands.Cog):
         return False
 
     def _apply_urlfilters(self, guild, url_filters, em_url):
+        return self._match_urlfilters(guild, self._compile_urlfilters(url_filters), em_url)
+
+    def _compile_urlfilters(self, url_filters):
+        """ Sort `(channel_id, thread_id, filters)` url filters and split their filters once.
+        """
+        sorted_url_filters = sorted(url_filters, key=lambda f: len(f[2]), reverse=True)
+        return [
+            (channel_id, thread_id, filters, [f.strip() for f in filters.split(',') if f])
+            for channel_id, thread_id, filters in sorted_url_filters
+        ]
+
+    def _match_urlfilters(self, guild, url_filters, em_url):
 
         # Only send message if filters are matched if no channel_id
         if len(url_filters) == 1 and not url_filters[0][0] and not url_filters[0][1]:
-            filters_list = url_filters[0][2].split(',')
-            filters_list_sanitized = [f for f in filters_list if f]
-            if not any(f.strip() in em_url for f in filters_list_sanitized):
+            filters_list = url_filters[0][3]
+            if not any(f in em_url for f in filters_list):
                 logger.info(f"[{guild.id}] Post Skipped. ({em_url} didn't match {filters_list} [Single Filter Mode]).")
                 return 'skip_post'
 
         # Send everything but adapt channel accordingly
         elif len(url_filters) > 0:
-            sorted_url_filters = sorted(url_filters, key=lambda f: len(f[2]), reverse=True)
-            for channel_id, thread_id, filters in sorted_url_filters:
-                filters_list = filters.split(',')
-                filters_list_sanitized = [f for f in filters_list if f]
-                if channel_id and any(f.strip() in em_url for f in filters_list_sanitized):
+            for channel_id, thread_id, filters, filters_list in url_filters:
+                if channel_id and any(f in em_url for f in filters_list):
                     new_channel = guild.get_channel(channel_id)
                     logger.info(f"[{guild.id}] Overriding channel by #{new_channel.name}: {em_url} matched {filters} [Multi Filter Mode]).")
                     return new_channel
-                elif thread_id and any(f.strip() in em_url for f in filters_list_sanitized):
+                elif thread_id and any(f in em_url for f in filters_list):
                     new_thread = guild.get_thread(thread_id)
                     if new_thread:
                         logger.info(f"[{guild.id}] Overriding channel by #{new_thread.name}: {em_url} matched {filters} [Multi Filter Mode]).")
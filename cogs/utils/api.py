@@ -1,69 +1,331 @@
+import json
 import logging
 import time
 import aiohttp
 
 import sec
-from aiohttp import ClientSession, ClientConnectorError, ClientTimeout, ContentTypeError
+from cogs.utils.breaker import CircuitBreaker, CLOSED
+from cogs.utils.limiter import AdaptiveLimiter
+from aiohttp import ClientSession, ClientConnectorError, ClientTimeout, ContentTypeError, TCPConnector
 import asyncio
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 logger = logging.getLogger('bot.API')
 
+# Connection pool settings of the shared session
+CONN_LIMIT = 100
+CONN_LIMIT_PER_HOST = 20
+CONN_KEEPALIVE_TIMEOUT = 60
+CONN_DNS_CACHE_TTL = 300
+
+# Games catalog cache, stale entries are served while being refreshed
+GAMES_TTL = int(sec.load('api_games_ttl') or 300)
+GAMES_RETRY_DELAY = 30
+
+# Accounts index cache per game, same stale-while-revalidate policy than the games catalog
+ACCOUNTS_TTL = int(sec.load('api_accounts_ttl') or 600)
+
+# Posts fetching, concurrent requests adapt between 1 and API_MAX_CONCURRENCY and
+# requests still running after API_POSTS_DEADLINE seconds are cancelled.
+POSTS_MAX_CONCURRENCY = int(sec.load('api_max_concurrency') or 16)
+POSTS_DEADLINE = int(sec.load('api_posts_deadline') or 20)
+POSTS_LATENCY_TARGET = 2.0
+
+# Returned by `fetch_posts` when the feed didn't change since the last conditional request
+NOT_MODIFIED = 'not_modified'
+# Returned by `fetch_posts` when the game's feed keeps failing and is backed off
+CIRCUIT_OPEN = 'circuit_open'
+# Returned by `fetch_all_posts` for requests cancelled by the deadline
+DEADLINE_EXCEEDED = 'deadline_exceeded'
+
+
+def get_json_loads(name=None):
+    """ JSON decoder taking the raw response bytes, orjson if installed unless
+    `name` (or the `api_json_decoder` secret) asks for 'json'.
+    """
+    name = name or sec.load('api_json_decoder') or 'orjson'
+    if name == 'orjson' and orjson:
+        return orjson.loads
+    return json.loads
+
+
+class PostsFeed:
+    """ Posts feed of a game, decoded in two phases.
+
+    Only ids and timestamps are kept once the feed has been indexed, along with the raw body.
+    Full posts are decoded again from it by `get_posts()`, which only feeds with new posts need,
+    the other ones drop their body with `release()` once compared to the saved state.
+    """
+
+    def __init__(self, body, loads):
+        self._body = body
+        self._loads = loads
+        self.timestamps = {p['id']: p['timestamp'] for p in loads(body)['data']}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def ids(self):
+        return list(self.timestamps.keys())
+
+    def get_posts(self, post_ids):
+        """ Full posts matching `post_ids`, latest first, the body is released.
+        """
+        if self._body is None:
+            return []
+
+        posts = [p for p in self._loads(self._body)['data'] if p['id'] in post_ids]
+        self.release()
+        return sorted(posts, key=lambda p: p['timestamp'], reverse=True)
+
+    def release(self):
+        self._body = None
+
+
+class AccountsIndex:
+    """ Accounts of a game, indexed by service and by identifier.
+    """
+
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self.by_identifier = {}
+        self.by_service = {}
+        for account in accounts:
+            self.by_identifier[account['identifier']] = account
+            self.by_service.setdefault(account['service'], []).append(account['identifier'])
+        self.services = set(self.by_service.keys())
+        self.fetched_at = time.monotonic()
+
+
 class API:
 
     _instances = {}
 
+    def __new__(cls, *args, **kwargs):
+        # Every module does `API()`, they must all share the same instance (and session)
+        if cls not in cls._instances:
+            cls._instances[cls] = super(API, cls).__new__(cls)
+        return cls._instances[cls]
+
     def __init__(self):
+        if hasattr(self, 'api_baseurl'):
+            return
+
         self.token = sec.load('api_token')
         self.headers = {
             'Authorization': f'Bearer {self.token}',
             'Cache-Control': 'no-cache'
         }
         self.api_baseurl = sec.load('api_base')
-
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(API, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
+        self._session = None
+        self.json_loads = get_json_loads()
+        logger.info(f'JSON decoder: {self.json_loads.__module__}')
+
+        self._games = None
+        self._games_fetched_at = 0.0
+        self._games_refresh = None
+
+        self._accounts_indexes = {}
+        self._accounts_refreshes = {}
+
+        # ETag / Last-Modified per URL, for conditional requests
+        self._validators = {}
+
+        # One circuit breaker per game feed
+        self._breakers = {}
+
+        self._posts_limiter = AdaptiveLimiter('posts', POSTS_MAX_CONCURRENCY, latency_target=POSTS_LATENCY_TARGET)
+
+        # Requests in flight, per (url, headers), and the number of callers awaiting each
+        self._inflight = {}
+        self._inflight_waiters = {}
+
+    def _get_session(self):
+        """ Lazily create the shared session, it must be created from within the event loop.
+        """
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(
+                limit=CONN_LIMIT,
+                limit_per_host=CONN_LIMIT_PER_HOST,
+                keepalive_timeout=CONN_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=CONN_DNS_CACHE_TTL,
+            )
+            self._session = ClientSession(headers=self.headers, connector=connector)
+            logger.debug('New HTTP session opened.')
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info('HTTP session closed.')
+        self._session = None
+
+    async def _get(self, url, headers=None, timeout=None, raw=False):
+        """ GET `url` and decode its JSON body, returns (status, headers, data).
+
+        Concurrent callers asking for the same request share a single call and the same
+        decoded data, which must not be mutated. The call is cancelled once every caller
+        has been. `data` is None on 304 responses, and the undecoded JSON body with `raw`.
+        """
+        key = (url, tuple(sorted(headers.items())) if headers else (), raw)
+        if key not in self._inflight:
+            fut = asyncio.ensure_future(self._do_get(url, headers, timeout, raw))
+            self._inflight[key] = fut
+
+            def _done(f):
+                self._inflight.pop(key, None)
+                # Mark the exception as retrieved if every caller has been cancelled
+                if not f.cancelled():
+                    f.exception()
+
+            fut.add_done_callback(_done)
+        else:
+            logger.debug(f'GET {url} | Joined in-flight request.')
+
+        fut = self._inflight[key]
+        self._inflight_waiters[fut] = self._inflight_waiters.get(fut, 0) + 1
+        try:
+            # One caller being cancelled must not cancel the request for the others
+            return await asyncio.shield(fut)
+        finally:
+            self._inflight_waiters[fut] -= 1
+            if not self._inflight_waiters[fut]:
+                del self._inflight_waiters[fut]
+                # Every caller has been cancelled, the request must not keep its connection
+                # past their deadline (nor run outside of the posts limiter)
+                if not fut.done():
+                    fut.cancel()
+
+    async def _do_get(self, url, headers, timeout, raw):
+        session = self._get_session()
+        # Passing timeout=None would disable the session default timeout
+        kwargs = {'timeout': timeout} if timeout else {}
+        async with session.get(url, headers=headers, **kwargs) as resp:
+            logger.debug(f'GET {url} {resp.status}')
+            if resp.status == 304:
+                return resp.status, resp.headers, None
+
+            # Same check than `resp.json()`, but the body is decoded straight from bytes
+            if not (resp.content_type == 'application/json' or resp.content_type.endswith('+json')):
+                raise ContentTypeError(
+                    resp.request_info,
+                    resp.history,
+                    status=resp.status,
+                    message=f'Attempt to decode JSON with unexpected mimetype: {resp.content_type}',
+                    headers=resp.headers,
+                )
+            body = (await resp.read()).strip()
+            if raw:
+                return resp.status, resp.headers, body
+            data = self.json_loads(body) if body else None
+            return resp.status, resp.headers, data
+
+    def _conditional_headers(self, url):
+        validators = self._validators.get(url, {})
+        headers = {}
+        if 'ETag' in validators:
+            headers['If-None-Match'] = validators['ETag']
+        if 'Last-Modified' in validators:
+            headers['If-Modified-Since'] = validators['Last-Modified']
+        return headers
+
+    def _store_validators(self, url, resp_headers):
+        validators = {h: resp_headers[h] for h in ('ETag', 'Last-Modified') if h in resp_headers}
+        if validators:
+            self._validators[url] = validators
+        else:
+            self._validators.pop(url, None)
+
+    def reset_validators(self):
+        """ Forget every validator, the next conditional requests will download full feeds.
+        """
+        self._validators.clear()
+
+    def _get_breaker(self, game_id):
+        if game_id not in self._breakers:
+            self._breakers[game_id] = CircuitBreaker(game_id)
+        return self._breakers[game_id]
+
+    def get_breakers_status(self):
+        """ Status of the feeds currently backed off, per game id.
+        """
+        return {
+            gid: breaker.status()
+            for gid, breaker in self._breakers.items()
+            if breaker.state != CLOSED
+        }
 
     async def get_status(self):
         url = f'{self.api_baseurl}/games'
         start = time.monotonic()
 
-        async with ClientSession(headers=self.headers) as session:
-            try:
-                async with session.get(url) as resp:
-                    await resp.json()
-                    logger.debug(f'GET {url} {resp.status}')
-                    response_time = time.monotonic() - start
-                    return resp.status, response_time
-            except ClientConnectorError as e:
-                # This likely means the API Endpoint is down.
-                logger.error(str(e))
-                return 500, None
-            except ContentTypeError as e:
-                # This likely means the API Endpoint crashed.
-                logger.error(str(e))
-                return 500, None
+        try:
+            status, _, _ = await self._get(url)
+            response_time = time.monotonic() - start
+            return status, response_time
+        except ClientConnectorError as e:
+            # This likely means the API Endpoint is down.
+            logger.error(str(e))
+            return 500, None
+        except ContentTypeError as e:
+            # This likely means the API Endpoint crashed.
+            logger.error(str(e))
+            return 500, None
 
     async def fetch_available_games(self):
+        """ Games catalog as {name: identifier}, served from cache.
+
+        A stale catalog is returned right away while a single background refresh
+        runs, only a cold cache waits for the API.
+        """
+        if self._games is None:
+            await asyncio.shield(self._schedule_games_refresh())
+        elif time.monotonic() - self._games_fetched_at > GAMES_TTL:
+            self._schedule_games_refresh()
+
+        return self._games or {}
+
+    def _schedule_games_refresh(self):
+        if self._games_refresh is None or self._games_refresh.done():
+            self._games_refresh = asyncio.ensure_future(self._refresh_games())
+        return self._games_refresh
+
+    async def _refresh_games(self):
+        try:
+            games = await self._request_available_games()
+        except Exception as e:
+            logger.error(f'Unhandled: {repr(e)}')
+            games = None
+
+        if games:
+            self._games = games
+            self._games_fetched_at = time.monotonic()
+        elif self._games:
+            # Keep the last good catalog, and retry a bit later instead of on every call
+            logger.warning(f'Games catalog refresh failed, serving cached data (retry in {GAMES_RETRY_DELAY}s).')
+            self._games_fetched_at = time.monotonic() - GAMES_TTL + GAMES_RETRY_DELAY
+
+    async def _request_available_games(self):
         url = f'{self.api_baseurl}/games'
         games = []
 
-        async with ClientSession(headers=self.headers) as session:
-            try:
-                async with session.get(url) as resp:
-                    response = await resp.json()
-                    logger.debug(f'GET {url} {resp.status}')
-                    games = response['data']
-                    api_games_data = [(g['identifier'], g['name']) for g in games]
-                    games = api_games_data
-            except ClientConnectorError as e:
-                logger.error(str(e))
-                games = None
-            except ContentTypeError as e:
-                logger.error(str(e))
-                games = None
+        try:
+            _, _, response = await self._get(url)
+            games = response['data']
+            api_games_data = [(g['identifier'], g['name']) for g in games]
+            games = api_games_data
+        except ClientConnectorError as e:
+            logger.error(str(e))
+            games = None
+        except ContentTypeError as e:
+            logger.error(str(e))
+            games = None
 
         game_dict = {}
         if games:
@@ -73,130 +335,163 @@ class API:
                 })
         return game_dict
 
-    async def fetch_posts(self, game_id):
+    async def fetch_posts(self, game_id, conditional=False):
+        """ Fetch the posts feed of a game, as a `PostsFeed`.
+
+        With `conditional`, the validators of the previous conditional request are sent
+        and `NOT_MODIFIED` is returned instead of the posts if the feed didn't change.
+        Callers must then have processed the previous result.
+        """
         url = f'{self.api_baseurl}/{game_id}/posts'
 
         timeout = ClientTimeout(total=5)
-        async with ClientSession(headers=self.headers, timeout=timeout) as session:
-            try:
-                async with session.get(url) as resp:
-                    response = await resp.json()
-                    logger.debug(f'GET {url} {resp.status}')
-                    posts = response['data']
-                    return {game_id: posts}
-
-            except asyncio.TimeoutError as e:
-                logger.warning(f'GET {url} | Timeout ({session.timeout}) - {e}')
-                return {game_id: 'timeout'}
-
-            except aiohttp.ContentTypeError as e:
-                # This likely means the API Endpoint crashed and gave
-                # an HTML fallback response instead of JSON.
-                logger.warning(f'GET {url} | ContentTypeError: {e.message}. (API Endpoint crashed)')
-                return {game_id: 'content_type_error'}
-
-            except Exception as e:
-                logger.error(f'Unhandled: {repr(e)}')
-                return {game_id: e}
-
-    async def fetch_all_posts(self, game_ids):
-
-        timeout = ClientTimeout(total=2)
-        async with ClientSession(headers=self.headers, timeout=timeout):
-            try:
-                res = await asyncio.gather(
-                    *[
-                        self.fetch_posts(gid)
-                        for gid in game_ids
-                    ],
-                    return_exceptions=True
-                )
-                return res
-
-            except asyncio.TimeoutError as e:
-                logger.error(f'TIMEOUT: The Fetchs posts process took more than {timeout.total} seconds. {e}')
-                return None
+        headers = self._conditional_headers(url) if conditional else None
+
+        breaker = self._get_breaker(game_id)
+        if not breaker.allow():
+            logger.debug(f'GET {url} | Skipped, circuit open.')
+            return {game_id: CIRCUIT_OPEN}
+
+        try:
+            status, resp_headers, body = await self._get(url, headers=headers, timeout=timeout, raw=True)
+            if status == 304:
+                breaker.record_success()
+                return {game_id: NOT_MODIFIED}
+
+            posts = PostsFeed(body, self.json_loads)
+            if conditional:
+                self._store_validators(url, resp_headers)
+            breaker.record_success()
+            return {game_id: posts}
+
+        except asyncio.TimeoutError as e:
+            logger.warning(f'GET {url} | Timeout ({timeout}) - {e}')
+            breaker.record_failure()
+            return {game_id: 'timeout'}
+
+        except aiohttp.ContentTypeError as e:
+            # This likely means the API Endpoint crashed and gave
+            # an HTML fallback response instead of JSON.
+            logger.warning(f'GET {url} | ContentTypeError: {e.message}. (API Endpoint crashed)')
+            breaker.record_failure()
+            return {game_id: 'content_type_error'}
+
+        except Exception as e:
+            logger.error(f'Unhandled: {repr(e)}')
+            breaker.record_failure()
+            return {game_id: e}
+
+    async def fetch_all_posts(self, game_ids, conditional=False):
+        # Every request goes through the shared session, so only one
+        # handshake per host is paid for the whole batch.
+        tasks = {
+            gid: asyncio.ensure_future(self._fetch_posts_limited(gid, conditional))
+            for gid in game_ids
+        }
+        if not tasks:
+            return []
+
+        _, pending = await asyncio.wait(tasks.values(), timeout=POSTS_DEADLINE)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.error(f'TIMEOUT: The Fetchs posts process took more than {POSTS_DEADLINE} seconds, {len(pending)} requests cancelled.')
+
+        res = []
+        for gid, task in tasks.items():
+            if task in pending:
+                res.append({gid: DEADLINE_EXCEEDED})
+            elif task.exception():
+                res.append(task.exception())
+            else:
+                res.append(task.result())
+
+        logger.debug(f'Posts concurrency limit: {int(self._posts_limiter.limit)}')
+        return res
+
+    async def _fetch_posts_limited(self, game_id, conditional):
+        async with self._posts_limiter:
+            start = time.monotonic()
+            res = await self.fetch_posts(game_id, conditional=conditional)
+            latency = time.monotonic() - start
+
+        if res[game_id] != CIRCUIT_OPEN:
+            ok = isinstance(res[game_id], PostsFeed) or res[game_id] == NOT_MODIFIED
+            self._posts_limiter.record(latency, ok)
+        return res
 
     async def fetch_post(self, post_id, game_id):
         url = f'{self.api_baseurl}/{game_id}/posts'
 
-        async with ClientSession(headers=self.headers) as session:
-            try:
-                async with session.get(url) as resp:
-                    content = await resp.json()
-                    logger.debug(f'GET {url} {resp.status}')
-                    posts = content['data']
-                    post = [p for p in posts if p['id'] == post_id]
-                    return post
-            except ClientConnectorError as e:
-                logger.error(str(e))
+        try:
+            _, _, content = await self._get(url)
+            posts = content['data']
+            post = [p for p in posts if p['id'] == post_id]
+            return post
+        except ClientConnectorError as e:
+            logger.error(str(e))
 
     async def fetch_latest_post(self, game_id):
         url = f'{self.api_baseurl}/{game_id}/posts'
 
-        async with ClientSession(headers=self.headers) as session:
-            try:
-                async with session.get(url) as resp:
-                    content = await resp.json()
-                    logger.debug(f'GET {url} {resp.status}')
-                    posts = content['data']
-                    return posts[0]
-            except ClientConnectorError as e:
-                logger.error(str(e))
+        try:
+            _, _, content = await self._get(url)
+            posts = content['data']
+            return posts[0]
+        except ClientConnectorError as e:
+            logger.error(str(e))
 
     async def fetch_accounts(self, game_id):
         url = f'{self.api_baseurl}/{game_id}/accounts'
 
-        async with ClientSession(headers=self.headers) as session:
-            try:
-                async with session.get(url) as resp:
-                    response = await resp.json()
-                    logger.debug(f'GET {url} {resp.status}')
-                    accounts = response['data']
-                    return accounts
-            except ClientConnectorError as e:
-                logger.error(str(e))
-                accounts = None
-            except ContentTypeError as e:
-                logger.error(str(e))
-                accounts = None
-
-    async def fetch_all_accounts(self, game_ids):
-
-        timeout = ClientTimeout(total=5)
-        async with ClientSession(headers=self.headers, timeout=timeout):
-            try:
-                res = await asyncio.gather(
-                    *[
-                        self.fetch_accounts(gid)
-                        for gid in game_ids
-                    ],
-                    return_exceptions=True
-                )
-                if all(res):
-                    return res
-
-                # Means some API calls failed
-                return None
-
-            except asyncio.TimeoutError as e:
-                logger.error(f'TIMEOUT: The Fetchs accounts process took more than {timeout.total} seconds. - {e}')
-                return None
+        try:
+            _, _, response = await self._get(url)
+            accounts = response['data']
+            return accounts
+        except ClientConnectorError as e:
+            logger.error(str(e))
+            accounts = None
+        except ContentTypeError as e:
+            logger.error(str(e))
+            accounts = None
+
+    async def get_accounts_index(self, game_id):
+        """ AccountsIndex of a game served from cache, None if the API never answered.
+
+        Like the games catalog, a stale index is returned right away while it's
+        refreshed in the background.
+        """
+        index = self._accounts_indexes.get(game_id)
+        if index is None:
+            await asyncio.shield(self._schedule_accounts_refresh(game_id))
+            index = self._accounts_indexes.get(game_id)
+        elif time.monotonic() - index.fetched_at > ACCOUNTS_TTL:
+            self._schedule_accounts_refresh(game_id)
+
+        return index
+
+    def _schedule_accounts_refresh(self, game_id):
+        task = self._accounts_refreshes.get(game_id)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._refresh_accounts(game_id))
+            self._accounts_refreshes[game_id] = task
+        return task
+
+    async def _refresh_accounts(self, game_id):
+        try:
+            accounts = await self.fetch_accounts(game_id)
+        except Exception as e:
+            logger.error(f'Unhandled: {repr(e)}')
+            accounts = None
+
+        if accounts is not None:
+            self._accounts_indexes[game_id] = AccountsIndex(accounts)
+        elif game_id in self._accounts_indexes:
+            logger.warning(f'{game_id}: Accounts refresh failed, serving cached data.')
+            self._accounts_indexes[game_id].fetched_at = time.monotonic() - ACCOUNTS_TTL + GAMES_RETRY_DELAY
 
     async def fetch_services(self, game_id):
-        url = f'{self.api_baseurl}/{game_id}/accounts'
-
-        async with ClientSession(headers=self.headers) as session:
-            try:
-                async with session.get(url) as resp:
-                    response = await resp.json()
-                    logger.debug(f'GET {url} {resp.status}')
-                    accounts = response['data']
-                    services = [a['service'] for a in accounts]
-                    return set(services)
-            except ClientConnectorError as e:
-                logger.error(str(e))
-                services = set('API Error')
-            except ContentTypeError as e:
-                logger.error(str(e))
-                services = set('API Error')
+        index = await self.get_accounts_index(game_id)
+        if index is None:
+            return None
+        return index.services
@@ -1,8 +1,8 @@
 import disnake
 import logging
 
-# Call are done for every user input made, but
-# API requests should be cached so it should not be an issue
+# Call are done for every user input made, but games and
+# accounts are cached by the API so it's not an issue
 from cogs.utils import api
 from cogs.utils import database as db
 
@@ -45,12 +45,13 @@ async def accounts_all(inter: disnake.ApplicationCommandInteraction, user_input:
         if 'service_id' not in inter.options['add']['account'].keys():
             return ['[ERROR] Please provide a valid service first']
         service_id = inter.options['add']['account']['service_id']
-        services = await API.fetch_services(game_id)
-        if service_id not in services:
+        accounts_index = await API.get_accounts_index(game_id)
+        if not accounts_index:
+            return ['[ERROR] API request failed. Retry later.']
+        if service_id not in accounts_index.services:
             return ['[ERROR] Invalid service provided']
-        accounts = await API.fetch_accounts(game_id)
 
-        account_ids = [a['identifier'] for a in accounts if a['service'] == service_id]
+        account_ids = accounts_index.by_service[service_id]
         max_list = [acc_id for acc_id in account_ids if user_input.lower() in acc_id.lower()]
         return max_list[0:24]
     except Exception as e:
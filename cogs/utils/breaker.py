@@ -0,0 +1,79 @@
+import logging
+import random
+import time
+
+logger = logging.getLogger('bot.utils.CircuitBreaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """ Stop calling an endpoint that keeps failing.
+
+    After `failure_threshold` consecutive failures the breaker opens and calls are refused
+    until a jittered, exponentially growing delay is over. A single probe is then let
+    through (half-open): a success closes the breaker, a failure opens it again for longer.
+    """
+
+    def __init__(self, name, failure_threshold=3, base_delay=60, max_delay=3600, probe_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.probe_timeout = probe_timeout
+
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.retry_at = 0.0
+        self._probe_started = 0.0
+
+    def allow(self):
+        now = time.monotonic()
+
+        if self.state == OPEN:
+            if now < self.retry_at:
+                return False
+            self.state = HALF_OPEN
+            self._probe_started = now
+            logger.info(f'{self.name}: Half-open, probing.')
+            return True
+
+        if self.state == HALF_OPEN:
+            # Only one probe at a time, unless the previous one never reported back
+            if now - self._probe_started < self.probe_timeout:
+                return False
+            self._probe_started = now
+
+        return True
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f'{self.name}: Closed after {self.failures} failures.')
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        delay = min(self.max_delay, self.base_delay * 2 ** self.trips)
+        # Full jitter on the upper half, so failing feeds don't all retry at once
+        delay = random.uniform(delay / 2, delay)
+        self.trips += 1
+        self.state = OPEN
+        self.retry_at = time.monotonic() + delay
+        logger.warning(f'{self.name}: Opened after {self.failures} failures, retry in {round(delay)}s.')
+
+    def status(self):
+        retry_in = max(0, round(self.retry_at - time.monotonic())) if self.state == OPEN else 0
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry_in': retry_in,
+        }
@@ -1,7 +1,11 @@
+import asyncio
 from collections import defaultdict
+from contextlib import asynccontextmanager
 import aiosqlite
+import json
 import logging
 
+import sec
 from cogs.utils import api
 API = api.API()
 
@@ -9,110 +13,261 @@ logger = logging.getLogger('bot.DB')
 
 DB_FILE = 'db/tracking.db'
 
+# Read-only connections, on top of the single writer connection
+DB_READERS = 2
+
+# PRAGMAs applied to every connection, selected with the `db_profile` secret.
+# `performance` trades durability of the last transactions on power loss (not on crash) for
+# much cheaper commits, and lets readers work while the refresh loop writes.
+DB_PROFILES = {
+    'performance': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'temp_store': 'MEMORY',
+        'cache_size': -16000,  # KiB
+        'mmap_size': 64 * 1024 * 1024,
+    },
+    'default': {},
+}
+DB_PROFILE = sec.load('db_profile') or 'performance'
+
+# How already seen posts are remembered, selected with the `posts_state` secret.
+# `ids` saves every post id of each feed, `watermark` only the latest (timestamp, post_id)
+# of each game and a window of the most recent post ids to catch ties and late arrivals.
+POSTS_STATE = sec.load('posts_state') or 'ids'
+WATERMARK_WINDOW = int(sec.load('posts_watermark_window') or 20)
+
+# Initial schema, `MIGRATIONS` are applied on top of it.
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS guilds (
+        id INTEGER PRIMARY KEY,
+        main_channel_id INTEGER
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS follows (
+        last_post_id NVARCHAR,
+        channel_id INTEGER,
+        follower_guild_id INTEGER NOT NULL,
+        followed_game_id NVARCHAR NOT NULL,
+        FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE,
+        FOREIGN KEY (followed_game_id) REFERENCES games (id) ON DELETE CASCADE,
+        PRIMARY KEY (follower_guild_id, followed_game_id)
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS games (
+        id NVARCHAR PRIMARY KEY,
+        name NVARCHAR
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS ignored_services (
+        follower_guild_id NOT NULL,
+        game_id NOT NULL,
+        service_id NOT NULL,
+        FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE
+        FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
+        PRIMARY KEY (follower_guild_id, game_id, service_id)
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS ignored_accounts (
+        follower_guild_id NOT NULL,
+        game_id NOT NULL,
+        account_id NOT NULL,
+        service_id NOT NULL,
+        FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE
+        FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
+        PRIMARY KEY (follower_guild_id, game_id, account_id)
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS allowed_services (
+        follower_guild_id NOT NULL,
+        game_id NOT NULL,
+        service_id NOT NULL,
+        FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE
+        FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
+        PRIMARY KEY (follower_guild_id, game_id, service_id)
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS allowed_accounts (
+        follower_guild_id NOT NULL,
+        game_id NOT NULL,
+        account_id NOT NULL,
+        service_id NOT NULL,
+        FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE
+        FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
+        PRIMARY KEY (follower_guild_id, game_id, account_id)
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS url_filters (
+        follower_guild_id NOT NULL,
+        game_id NOT NULL,
+        service_id NVARCHAR NOT NULL,
+        filters TEXT NOT NULL,
+        channel_id INTEGER,
+        thread_id INTEGER,
+        FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE
+        FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
+        PRIMARY KEY (follower_guild_id, game_id, service_id, channel_id, thread_id)
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS posts (
+        game_id NVARCHAR NOT NULL,
+        post_id NVARCHAR NOT NULL,
+        FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
+    );
+    ''',
+]
+
+# Schema migrations, applied in order on top of the initial schema.
+# The index of the last one applied is stored in `PRAGMA user_version`.
+MIGRATIONS = [
+    # 1: `posts` had no key at all, every tick reads and rewrites it per game.
+    '''
+        CREATE TABLE posts_new (
+            game_id NVARCHAR NOT NULL,
+            post_id NVARCHAR NOT NULL,
+            FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE,
+            PRIMARY KEY (game_id, post_id)
+        ) WITHOUT ROWID;
+        INSERT OR IGNORE INTO posts_new (game_id, post_id) SELECT game_id, post_id FROM posts;
+        DROP TABLE posts;
+        ALTER TABLE posts_new RENAME TO posts;
+    ''',
+    # 2: Accounts lists are updated per account_id, their primary keys lead with the guild.
+    '''
+        CREATE INDEX IF NOT EXISTS idx_ignored_accounts_account_id ON ignored_accounts (account_id);
+        CREATE INDEX IF NOT EXISTS idx_allowed_accounts_account_id ON allowed_accounts (account_id);
+    ''',
+    # 3: Posts state of the `watermark` mode, `recent_posts` is a JSON list of [timestamp, post_id].
+    '''
+        CREATE TABLE IF NOT EXISTS posts_watermarks (
+            game_id NVARCHAR PRIMARY KEY,
+            timestamp INTEGER NOT NULL,
+            post_id NVARCHAR NOT NULL,
+            recent_posts NVARCHAR NOT NULL,
+            FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
+        );
+    ''',
+]
+
 
 class ORM:
 
     _instances = {}
 
-    def __call__(cls, *args, **kwargs):
+    def __new__(cls, *args, **kwargs):
+        # Every module does `ORM()`, they must all share the same connections
         if cls not in cls._instances:
-            cls._instances[cls] = super(ORM, cls).__call__(*args, **kwargs)
+            cls._instances[cls] = super(ORM, cls).__new__(cls)
         return cls._instances[cls]
 
+    def __init__(self):
+        if hasattr(self, '_writer'):
+            return
+
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+
+        # Ignore/allow lists snapshot, see get_filters()
+        self._filters = None
+        self._filters_version = 0
+
+        # Follows and their channels per game snapshot, see get_routes()
+        self._routes = None
+        self._routes_version = 0
+
+        # Write-behind buffer of last_post_id per (guild_id, game_id), see flush_last_posts()
+        self._pending_last_posts = {}
+
+    async def _open(self):
+        conn = await aiosqlite.connect(DB_FILE)
+        conn.row_factory = aiosqlite.Row
+        for pragma, value in DB_PROFILES[DB_PROFILE].items():
+            await conn.execute(f"PRAGMA {pragma} = {value}")
+        await conn.set_trace_callback(logger.debug)
+        return conn
+
+    async def maintenance(self):
+        """ Refresh the query planner statistics and fold the WAL back into the database.
+        """
+        async with self._write() as conn:
+            await conn.execute("PRAGMA optimize")
+            if DB_PROFILES[DB_PROFILE].get('journal_mode') == 'WAL':
+                async with conn.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cr:
+                    busy, wal_pages, checkpointed_pages = await cr.fetchone()
+                logger.info(f'WAL checkpoint: {checkpointed_pages}/{wal_pages} pages (busy: {busy}).')
+
+    @asynccontextmanager
+    async def _write(self, foreign_keys=False):
+        """ Exclusive access to the writer connection.
+
+        Anything left uncommitted when leaving is rolled back, like closing
+        a dedicated connection would.
+        """
+        async with self._write_lock:
+            conn = self._writer
+            if foreign_keys:
+                await conn.execute("PRAGMA foreign_keys = 1")
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    await conn.rollback()
+                if foreign_keys:
+                    await conn.execute("PRAGMA foreign_keys = 0")
+
+    @asynccontextmanager
+    async def _read(self):
+        """ A reader connection from the pool, or the writer one if there's no pool.
+        """
+        if not DB_READERS:
+            async with self._write() as conn:
+                yield conn
+            return
+
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
     async def initialize(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS guilds (
-                    id INTEGER PRIMARY KEY,
-                    main_channel_id INTEGER
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS follows (
-                    last_post_id NVARCHAR,
-                    channel_id INTEGER,
-                    follower_guild_id INTEGER NOT NULL,
-                    followed_game_id NVARCHAR NOT NULL,
-                    FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE,
-                    FOREIGN KEY (followed_game_id) REFERENCES games (id) ON DELETE CASCADE,
-                    PRIMARY KEY (follower_guild_id, followed_game_id)
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS games (
-                    id NVARCHAR PRIMARY KEY,
-                    name NVARCHAR
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS ignored_services (
-                    follower_guild_id NOT NULL,
-                    game_id NOT NULL,
-                    service_id NOT NULL,
-                    FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE
-                    FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
-                    PRIMARY KEY (follower_guild_id, game_id, service_id)
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS ignored_accounts (
-                    follower_guild_id NOT NULL,
-                    game_id NOT NULL,
-                    account_id NOT NULL,
-                    service_id NOT NULL,
-                    FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE
-                    FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
-                    PRIMARY KEY (follower_guild_id, game_id, account_id)
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS allowed_services (
-                    follower_guild_id NOT NULL,
-                    game_id NOT NULL,
-                    service_id NOT NULL,
-                    FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE
-                    FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
-                    PRIMARY KEY (follower_guild_id, game_id, service_id)
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS allowed_accounts (
-                    follower_guild_id NOT NULL,
-                    game_id NOT NULL,
-                    account_id NOT NULL,
-                    service_id NOT NULL,
-                    FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE
-                    FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
-                    PRIMARY KEY (follower_guild_id, game_id, account_id)
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS url_filters (
-                    follower_guild_id NOT NULL,
-                    game_id NOT NULL,
-                    service_id NVARCHAR NOT NULL,
-                    filters TEXT NOT NULL,
-                    channel_id INTEGER,
-                    thread_id INTEGER,
-                    FOREIGN KEY (follower_guild_id) REFERENCES guilds (id) ON DELETE CASCADE
-                    FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
-                    PRIMARY KEY (follower_guild_id, game_id, service_id, channel_id, thread_id)
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS posts (
-                    game_id NVARCHAR NOT NULL,
-                    post_id NVARCHAR NOT NULL,
-                    FOREIGN KEY (game_id) REFERENCES games (id) ON DELETE CASCADE
-                );
-            ''')
+        logger.info(f'Database profile: {DB_PROFILE}')
+        self._writer = await self._open()
+        for _ in range(DB_READERS):
+            self._readers.put_nowait(await self._open())
+
+        async with self._write() as conn:
+            for statement in SCHEMA:
+                await conn.execute(statement)
             await conn.commit()
+            await self._migrate(conn)
         await self.reset_account_services()
 
-    async def add_guild(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
+    async def _migrate(self, conn):
+        async with conn.execute("PRAGMA user_version") as cr:
+            version = (await cr.fetchone())[0]
+
+        for idx, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f'Applying schema migration {idx}.')
+            await conn.executescript(f'''
+                BEGIN;
+                {migration}
+                PRAGMA user_version = {idx};
+                COMMIT;
+            ''')
 
+    async def add_guild(self, guild_id):
+        async with self._write() as conn:
             query = "INSERT OR IGNORE INTO guilds ('id', 'main_channel_id') VALUES (?, ?);"
             params = (guild_id, None)
 
@@ -120,20 +275,17 @@ class ORM:
             await conn.commit()
 
     async def rm_guild(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-            await conn.execute("PRAGMA foreign_keys = 1")
-
+        async with self._write(foreign_keys=True) as conn:
             query = "DELETE FROM guilds WHERE id = ?;"
             params = (guild_id,)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_filters()
+            self._invalidate_routes()
 
     async def dump_guilds(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT id, main_channel_id FROM guilds"
 
             async with conn.execute(query) as cr:
@@ -141,10 +293,7 @@ class ORM:
                     print(tuple(row))
 
     async def get_all_guilds(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT id FROM guilds;"
 
             guilds = []
@@ -154,20 +303,16 @@ class ORM:
             return guilds
 
     async def add_followed_game(self, game_id, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "INSERT OR IGNORE INTO follows ('last_post_id', 'channel_id', 'follower_guild_id', 'followed_game_id' ) VALUES (?, ?, ?, ?);"
             params = (None, None, guild_id, game_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_routes()
 
     async def rm_followed_game(self, game_id, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-            await conn.execute("PRAGMA foreign_keys = 1")
-
+        async with self._write(foreign_keys=True) as conn:
             params = (game_id, guild_id)
             query = "DELETE FROM follows WHERE followed_game_id = ? AND follower_guild_id = ?;"
             await conn.execute(query, params)
@@ -183,11 +328,12 @@ class ORM:
             await conn.execute(query, params)
 
             await conn.commit()
+            self._invalidate_filters()
+            self._invalidate_routes()
 
     async def dump_follows(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        await self.flush_last_posts()
+        async with self._read() as conn:
             query = "SELECT * FROM follows;"
 
             async with conn.execute(query) as cr:
@@ -195,8 +341,8 @@ class ORM:
                     print(tuple(row))
 
     async def get_follow_status(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
+        await self.flush_last_posts()
+        async with self._read() as conn:
             game_names = []
             async with conn.execute("SELECT g.id,g.name,fw.channel_id,fw.last_post_id FROM games AS g INNER JOIN follows AS fw ON g.id = fw.followed_game_id WHERE fw.follower_guild_id = ? ;", (guild_id,)) as cr:
                 async for row in cr:
@@ -204,9 +350,8 @@ class ORM:
             return game_names
 
     async def get_follow(self, guild_id, game_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        await self.flush_last_posts()
+        async with self._read() as conn:
             query = "SELECT * FROM follows WHERE follower_guild_id = ? AND followed_game_id = ?;"
             params = (guild_id, game_id)
 
@@ -217,9 +362,8 @@ class ORM:
             return follows[0] if follows else None
 
     async def get_follows(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        await self.flush_last_posts()
+        async with self._read() as conn:
             query = "SELECT * FROM follows WHERE follower_guild_id = ?;"
             params = (guild_id,)
 
@@ -230,19 +374,17 @@ class ORM:
             return follows
 
     async def rm_follow(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "DELETE FROM follows WHERE follower_guild_id = ?;"
             params = (guild_id,)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_routes()
 
     async def get_all_follows(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        await self.flush_last_posts()
+        async with self._read() as conn:
             query = "SELECT * FROM follows;"
 
             follows = []
@@ -252,49 +394,60 @@ class ORM:
             return follows
 
     async def set_last_post(self, post_id, guild_id, game_id):
+        """ Buffered, written with the others by the next flush_last_posts().
+        """
         logger.debug(f"{guild_id}: Set {post_id} as last `{game_id}` post.")
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
+        self._pending_last_posts[(guild_id, game_id)] = post_id
+
+    async def flush_last_posts(self):
+        """ Write every buffered last_post_id in a single transaction.
+        """
+        if not self._pending_last_posts:
+            return
+
+        pending, self._pending_last_posts = self._pending_last_posts, {}
+        params = [(post_id, guild_id, game_id) for (guild_id, game_id), post_id in pending.items()]
+        try:
+            async with self._write() as conn:
+                query = "UPDATE follows SET last_post_id = ? WHERE follower_guild_id = ? AND followed_game_id = ?;"
+                await conn.executemany(query, params)
+                await conn.commit()
+        except Exception:
+            # Keep them for the next flush, without overriding newer ones
+            self._pending_last_posts = {**pending, **self._pending_last_posts}
+            raise
+        logger.debug(f'{len(params)} last posts flushed.')
 
-            query = "UPDATE follows SET last_post_id = ? WHERE follower_guild_id = ? AND followed_game_id = ?;"
-            params = (post_id, guild_id, game_id)
+    async def reset_account_services(self):
 
-            await conn.execute(query, params)
-            await conn.commit()
+        async def _get_query_params(accounts):
+            params = []
 
-    async def reset_account_services(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
+            game_ids = list(set([game_id for _, game_id, _, _ in accounts]))
+            accounts_indexes = await asyncio.gather(*[API.get_accounts_index(gid) for gid in game_ids])
+            if not all(accounts_indexes):
+                logger.error(f'Could not fetch accounts for {game_ids}')
+                return None
+            accounts_index_per_game = dict(zip(game_ids, accounts_indexes))
 
-            async def _get_query_params(accounts):
-                params = []
+            for guild_id, game_id, account_id, service_id in accounts:
 
-                game_ids = set([game_id for _, game_id, _, _ in accounts])
-                followable_accounts = await API.fetch_all_accounts(game_ids)
-                if not followable_accounts:
-                    logger.error(f'Could not fetch accounts for {game_ids}')
-                    return None
-                service_per_game_per_account = defaultdict(dict)
-                for game_idx, followable_accounts_per_game in enumerate(followable_accounts):
-                    game_id = list(game_ids)[game_idx]
-                    for account in followable_accounts_per_game:
-                        service_per_game_per_account[game_id][account['identifier']] = account['service']
-
-                for guild_id, game_id, account_id, service_id in accounts:
-
-                    service_id_detected = service_per_game_per_account[game_id].get(account_id, None)
-                    if service_id_detected:
-                        params.append((service_id_detected, account_id))
-                return params
-
-            ignored_accounts = await self.get_all_ignored_accounts()
-            allowed_accounts = await self.get_all_allowed_accounts()
-
-            params_ignored = await _get_query_params(ignored_accounts)
-            params_allowed = await _get_query_params(allowed_accounts)
-            if not params_ignored or not params_allowed:
-                logger.error('No params received. Aborting accounts reset.')
-                return
+                account = accounts_index_per_game[game_id].by_identifier.get(account_id, None)
+                if account:
+                    params.append((account['service'], account_id))
+            return params
+
+        # API calls are done before taking the connection, writers would wait for them otherwise
+        ignored_accounts = await self.get_all_ignored_accounts()
+        allowed_accounts = await self.get_all_allowed_accounts()
+
+        params_ignored = await _get_query_params(ignored_accounts)
+        params_allowed = await _get_query_params(allowed_accounts)
+        if not params_ignored or not params_allowed:
+            logger.error('No params received. Aborting accounts reset.')
+            return
+
+        async with self._write() as conn:
             query_ignored = "UPDATE ignored_accounts SET service_id = ? WHERE account_id = ?;"
             query_allowed = "UPDATE allowed_accounts SET service_id = ? WHERE account_id = ?;"
             await conn.executemany(query_ignored, params_ignored)
@@ -303,30 +456,25 @@ class ORM:
             await conn.commit()
 
     async def set_main_channel(self, channel_id, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "UPDATE guilds SET main_channel_id = ? WHERE id = ?;"
             params = (channel_id, guild_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_routes()
 
     async def unset_main_channel(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "UPDATE guilds SET main_channel_id = ? WHERE id = ?;"
             params = (None, guild_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_routes()
 
     async def get_main_channel(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT main_channel_id FROM guilds WHERE id = ?;"
             params = (guild_id,)
 
@@ -336,40 +484,34 @@ class ORM:
             return None
 
     async def set_game_channel(self, channel_id, guild_id, game_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "UPDATE follows SET channel_id = ? WHERE follower_guild_id = ? AND followed_game_id = ?;"
             params = (channel_id, guild_id, game_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_routes()
 
     async def add_fw_game_channel(self, channel_id, guild_id, game_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "INSERT OR IGNORE INTO follows ('last_post_id', 'channel_id', 'follower_guild_id', 'followed_game_id' ) VALUES (?, ?, ?, ?);"
             params = (None, channel_id, guild_id, game_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_routes()
 
     async def unset_game_channel(self, guild_id, game_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "UPDATE follows SET channel_id = ? WHERE follower_guild_id = ? AND followed_game_id = ?;"
             params = (None, guild_id, game_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_routes()
 
     async def get_game_channel(self, game_id, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             # Check if a channel is set per game
             query = "SELECT channel_id FROM follows WHERE followed_game_id = ? AND follower_guild_id = ?;"
             params = (game_id, guild_id)
@@ -380,9 +522,7 @@ class ORM:
             return None
 
     async def get_local_games(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT * FROM games;"
 
             api_games_ids = []
@@ -393,9 +533,7 @@ class ORM:
             return api_games_ids
 
     async def update_local_games(self, api_games: tuple):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
+        async with self._write() as conn:
             # Uncomment line below to delete follows of games not in API
             # await conn.execute("PRAGMA foreign_keys = 1")
 
@@ -423,6 +561,8 @@ class ORM:
                 query = "DELETE FROM games WHERE id IN (?);"
                 await conn.executemany(query, to_rem)
                 await conn.commit()
+                self._invalidate_filters()
+                self._invalidate_routes()
 
             to_add = api_games_ids.difference(db_games_ids)
             to_add = [game for game in api_games.items() if game[1] in to_add]
@@ -433,9 +573,7 @@ class ORM:
                 await conn.commit()
 
     async def get_followed_games(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT g.name,g.id FROM games AS g INNER JOIN follows AS fw ON g.id = fw.followed_game_id WHERE fw.follower_guild_id = ? ;"
             params = (guild_id,)
 
@@ -449,10 +587,7 @@ class ORM:
             return followed_games_ids
 
     async def get_all_followed_games(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT followed_game_id FROM follows;"
 
             followed_games_ids = set()
@@ -463,10 +598,72 @@ class ORM:
             logger.debug(f'Followed Games: {followed_games_ids}')
             return followed_games_ids
 
-    async def get_all_ignored_accounts_per_guild(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
+    async def get_filters(self):
+        """ Ignore/allow lists of every guild, as `(ignored_accounts, ignored_services, allowed_accounts, allowed_services)`.
+
+        Loaded once and kept in memory, the add_*/rm_* methods invalidate it so it's reloaded on next call.
+        """
+        if self._filters is None:
+            version = self._filters_version
+            filters = (
+                await self.get_all_ignored_accounts_per_guild(),
+                await self.get_all_ignored_services(),
+                await self.get_all_allowed_accounts_per_guild(),
+                await self.get_all_allowed_services(),
+            )
+            # A write happened while loading, this one might be stale already
+            if version != self._filters_version:
+                return filters
+            self._filters = filters
+            logger.debug('Filters snapshot loaded.')
+        return self._filters
+
+    def _invalidate_filters(self):
+        self._filters = None
+        self._filters_version += 1
+
+    async def get_routes(self):
+        """ Follows of every game, as `{game_id: [(guild_id, channel_id, main_channel_id, thread_filters, url_filters_per_service)]}`.
+
+        Loaded once and kept in memory, the methods writing follows, channels or url filters invalidate it.
+        """
+        if self._routes is None:
+            version = self._routes_version
+            async with self._read() as conn:
+                url_filters = defaultdict(lambda: defaultdict(list))
+                thread_filters = defaultdict(list)
+                query = "SELECT follower_guild_id,game_id,service_id,channel_id,thread_id,filters FROM url_filters;"
+                async with conn.execute(query) as cr:
+                    async for row in cr:
+                        key = (row['follower_guild_id'], row['game_id'])
+                        url_filters[key][row['service_id']].append((row['channel_id'], row['thread_id'], row['filters']))
+                        if row['thread_id'] is not None:
+                            thread_filters[key].append((row['thread_id'], row['filters']))
+
+                routes = defaultdict(list)
+                query = """
+                    SELECT fw.followed_game_id,fw.follower_guild_id,fw.channel_id,g.main_channel_id
+                    FROM follows AS fw LEFT JOIN guilds AS g ON g.id = fw.follower_guild_id
+                    ORDER BY fw.follower_guild_id;
+                """
+                async with conn.execute(query) as cr:
+                    async for game_id, guild_id, channel_id, main_channel_id in cr:
+                        key = (guild_id, game_id)
+                        routes[game_id].append((guild_id, channel_id, main_channel_id, thread_filters[key], dict(url_filters[key])))
+
+            # A write happened while loading, this one might be stale already
+            if version != self._routes_version:
+                return routes
+            self._routes = routes
+            logger.debug('Routes snapshot loaded.')
+        return self._routes
+
+    def _invalidate_routes(self):
+        self._routes = None
+        self._routes_version += 1
 
+    async def get_all_ignored_accounts_per_guild(self):
+        async with self._read() as conn:
             query = "SELECT follower_guild_id,game_id,account_id FROM ignored_accounts;"
 
             ignored_accounts = []
@@ -481,9 +678,7 @@ class ORM:
             return ignored_per_guild
 
     async def get_all_ignored_accounts(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT follower_guild_id,game_id,account_id,service_id FROM ignored_accounts;"
 
             ignored_accounts = []
@@ -494,9 +689,7 @@ class ORM:
             return ignored_accounts
 
     async def get_all_allowed_accounts_per_guild(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT follower_guild_id,game_id,account_id FROM allowed_accounts;"
 
             allowed_accounts = []
@@ -511,9 +704,7 @@ class ORM:
             return allowed_per_guild
 
     async def get_all_allowed_accounts(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT follower_guild_id,game_id,account_id, service_id FROM allowed_accounts;"
 
             allowed_accounts = []
@@ -524,9 +715,7 @@ class ORM:
             return allowed_accounts
 
     async def get_all_ignored_services(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT follower_guild_id,game_id,service_id FROM ignored_services;"
 
             ignored_services = []
@@ -541,9 +730,7 @@ class ORM:
             return ignored_per_guild
 
     async def get_all_allowed_services(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT follower_guild_id,game_id,service_id FROM allowed_services;"
 
             allowed_services = []
@@ -558,50 +745,43 @@ class ORM:
             return allowed_per_guild
 
     async def add_ignored_account(self, guild_id, game_id, account_id, service_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "INSERT OR IGNORE INTO ignored_accounts ('follower_guild_id', 'game_id', 'account_id', 'service_id') VALUES (?, ?, ?, ?);"
             params = (guild_id, game_id, account_id, service_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_filters()
 
     async def add_allowed_account(self, guild_id, game_id, account_id, service_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "INSERT OR IGNORE INTO allowed_accounts ('follower_guild_id', 'game_id', 'account_id', 'service_id') VALUES (?, ?, ?, ?);"
             params = (guild_id, game_id, account_id, service_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_filters()
 
     async def add_ignored_service(self, guild_id, game_id, service_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "INSERT OR IGNORE INTO ignored_services ('follower_guild_id', 'game_id', 'service_id') VALUES (?, ?, ?);"
             params = (guild_id, game_id, service_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_filters()
 
     async def add_allowed_service(self, guild_id, game_id, service_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "INSERT OR IGNORE INTO allowed_services ('follower_guild_id', 'game_id', 'service_id') VALUES (?, ?, ?);"
             params = (guild_id, game_id, service_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_filters()
 
     async def get_ignored_accounts(self, guild_id, game_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT account_id FROM ignored_accounts WHERE follower_guild_id = ? AND game_id = ? ;"
             params = (guild_id, game_id)
 
@@ -613,10 +793,7 @@ class ORM:
             return ignored_accounts
 
     async def get_allowed_accounts(self, guild_id, game_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT account_id FROM allowed_accounts WHERE follower_guild_id = ? AND game_id = ? ;"
             params = (guild_id, game_id)
 
@@ -628,10 +805,7 @@ class ORM:
             return allowed_accounts
 
     async def get_ignored_services(self, guild_id, game_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT service_id FROM ignored_services WHERE follower_guild_id = ? AND game_id = ? ;"
             params = (guild_id, game_id)
 
@@ -643,10 +817,7 @@ class ORM:
             return ignored_services
 
     async def get_allowed_services(self, guild_id, game_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT service_id FROM allowed_services WHERE follower_guild_id = ? AND game_id = ? ;"
             params = (guild_id, game_id)
 
@@ -658,10 +829,7 @@ class ORM:
             return allowed_services
 
     async def get_ignored_accounts_per_game(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT game_id,account_id FROM ignored_accounts WHERE follower_guild_id = ? ;"
             params = (guild_id,)
 
@@ -677,10 +845,7 @@ class ORM:
             return ignored_accounts_per_game
 
     async def get_allowed_accounts_per_game(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT game_id,account_id FROM allowed_accounts WHERE follower_guild_id = ? ;"
             params = (guild_id,)
 
@@ -696,10 +861,7 @@ class ORM:
             return allowed_accounts_per_game
 
     async def get_ignored_services_per_game(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT game_id,service_id FROM ignored_services WHERE follower_guild_id = ? ;"
             params = (guild_id,)
 
@@ -715,10 +877,7 @@ class ORM:
             return ignored_services_per_game
 
     async def get_allowed_services_per_game(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT game_id,service_id FROM allowed_services WHERE follower_guild_id = ? ;"
             params = (guild_id,)
 
@@ -734,77 +893,132 @@ class ORM:
             return allowed_services_per_game
 
     async def rm_ignored_account(self, guild_id, game_id, account_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "DELETE FROM ignored_accounts WHERE follower_guild_id = ? AND game_id = ? AND account_id = ?;"
             params = (guild_id, game_id, account_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_filters()
 
     async def rm_allowed_account(self, guild_id, game_id, account_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "DELETE FROM allowed_accounts WHERE follower_guild_id = ? AND game_id = ? AND account_id = ?;"
             params = (guild_id, game_id, account_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_filters()
 
     async def rm_ignored_service(self, guild_id, game_id, service_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "DELETE FROM ignored_services WHERE follower_guild_id = ? AND game_id = ? AND service_id = ?;"
             params = (guild_id, game_id, service_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_filters()
 
     async def rm_allowed_service(self, guild_id, game_id, service_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._write() as conn:
             query = "DELETE FROM allowed_services WHERE follower_guild_id = ? AND game_id = ? AND service_id = ?;"
             params = (guild_id, game_id, service_id)
 
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_filters()
 
-    async def get_saved_post_ids(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
+    async def get_watermarks(self):
+        """ `(floor_timestamp, recent_post_ids)` per game, posts not newer than the floor or in the recent ones were already seen.
 
-            query = "SELECT * FROM posts;"
+        The floor is the oldest post of the window, ties with it are ignored so posts pushed out of the window aren't sent again.
+        """
+        async with self._read() as conn:
+            query = "SELECT game_id, recent_posts FROM posts_watermarks;"
 
-            saved_posts = defaultdict(list)
+            watermarks = {}
             async with conn.execute(query) as cr:
                 async for row in cr:
-                    saved_posts[row['game_id']].append(row['post_id'])
-            return saved_posts
+                    recent_posts = json.loads(row['recent_posts'])
+                    floor_timestamp = min(ts for ts, _ in recent_posts)
+                    watermarks[row['game_id']] = (floor_timestamp, {post_id for _, post_id in recent_posts})
+            return watermarks
+
+    async def update_watermarks(self, timestamps_per_game: dict):
+        """ Move the watermark of several games with their `{post_id: timestamp}` seen posts, in a single transaction.
+        """
+        timestamps_per_game = {gid: timestamps for gid, timestamps in timestamps_per_game.items() if timestamps}
+        if not timestamps_per_game:
+            return
+
+        async with self._write() as conn:
+            params = []
+            for game_id, timestamps in timestamps_per_game.items():
+                query = "SELECT recent_posts FROM posts_watermarks WHERE game_id = ?;"
+                async with conn.execute(query, (game_id,)) as cr:
+                    row = await cr.fetchone()
+
+                recent_posts = {post_id: ts for ts, post_id in json.loads(row['recent_posts'])} if row else {}
+                recent_posts.update(timestamps)
+                recent_posts = sorted(((ts, post_id) for post_id, ts in recent_posts.items()), reverse=True)[:WATERMARK_WINDOW]
+
+                timestamp, post_id = recent_posts[0]
+                params.append((game_id, timestamp, post_id, json.dumps(recent_posts)))
+
+            query = "INSERT OR REPLACE INTO posts_watermarks ('game_id', 'timestamp', 'post_id', 'recent_posts') VALUES (?, ?, ?, ?);"
+            await conn.executemany(query, params)
+            await conn.commit()
 
-    async def set_saved_post_ids(self, game_id: int, post_ids: list):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
+        logger.debug(f'Watermarks updated for {len(params)} games.')
 
-            query = "DELETE FROM posts WHERE game_id = ?;"
-            params = (game_id,)
-            await conn.execute(query, params)
+    async def get_saved_post_ids(self, game_ids=None):
+        """ Saved post ids per game, of `game_ids` only if given.
+        """
+        async with self._read() as conn:
+            if game_ids is None:
+                query = "SELECT game_id, post_id FROM posts;"
+                params = ()
+            else:
+                game_ids = list(game_ids)
+                query = f"SELECT game_id, post_id FROM posts WHERE game_id IN ({', '.join('?' * len(game_ids))});"
+                params = game_ids
 
-            query = "INSERT INTO posts VALUES (?, ?);"
-            params = [(game_id, post_id) for post_id in post_ids]
-            await conn.executemany(query, params)
+            saved_posts = defaultdict(list)
+            async with conn.execute(query, params) as cr:
+                async for row in cr:
+                    saved_posts[row['game_id']].append(row['post_id'])
+            return saved_posts
+
+    async def update_saved_post_ids(self, post_ids_per_game: dict):
+        """ Sync the saved post ids of several games with their current ones, in a single transaction.
+
+        Only new ids are inserted and pruned ones deleted, the other rows are left untouched.
+        """
+        if not post_ids_per_game:
+            return
+
+        async with self._write() as conn:
+            to_add = []
+            to_rem = []
+            for game_id, post_ids in post_ids_per_game.items():
+                query = "SELECT post_id FROM posts WHERE game_id = ?;"
+                async with conn.execute(query, (game_id,)) as cr:
+                    saved_post_ids = {row['post_id'] async for row in cr}
+
+                post_ids = set(post_ids)
+                to_add += [(game_id, post_id) for post_id in post_ids.difference(saved_post_ids)]
+                to_rem += [(game_id, post_id) for post_id in saved_post_ids.difference(post_ids)]
+
+            query = "DELETE FROM posts WHERE game_id = ? AND post_id = ?;"
+            await conn.executemany(query, to_rem)
+            query = "INSERT OR IGNORE INTO posts VALUES (?, ?);"
+            await conn.executemany(query, to_add)
             await conn.commit()
 
-    async def get_urlfilters_per_game(self, guild_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
+        logger.debug(f'Posts state updated for {len(post_ids_per_game)} games ({len(to_add)} added, {len(to_rem)} removed).')
 
+    async def get_urlfilters_per_game(self, guild_id):
+        async with self._read() as conn:
             query = "SELECT game_id,service_id,channel_id,thread_id,filters FROM url_filters WHERE follower_guild_id = ?;"
             params = (guild_id,)
 
@@ -819,10 +1033,7 @@ class ORM:
             return urlfiters_services_per_game
 
     async def get_urlfilters(self, guild_id, game_id, service_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT channel_id,thread_id,filters FROM url_filters WHERE follower_guild_id = ? AND game_id = ? AND service_id = ?;"
             params = (guild_id, game_id, service_id)
 
@@ -834,10 +1045,7 @@ class ORM:
             return url_filters
 
     async def get_urlfilters_thread(self, guild_id, game_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT thread_id,filters FROM url_filters WHERE follower_guild_id = ? AND game_id = ? AND thread_id IS NOT NULL;"
             params = (guild_id, game_id)
 
@@ -849,10 +1057,7 @@ class ORM:
             return url_filters
 
     async def get_urlfilters_channel(self, guild_id, game_id, service_id, channel_id=None, thread_id=None):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT filters FROM url_filters WHERE follower_guild_id = ? AND game_id = ? AND service_id = ?;"
             params = (guild_id, game_id, service_id)
 
@@ -871,10 +1076,7 @@ class ORM:
                     return None
 
     async def get_urlfilters_per_service(self, guild_id, game_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            conn.row_factory = aiosqlite.Row
-            await conn.set_trace_callback(logger.debug)
-
+        async with self._read() as conn:
             query = "SELECT service_id,channel_id,thread_id,filters FROM url_filters WHERE follower_guild_id = ? AND game_id = ?;"
             params = (guild_id, game_id)
 
@@ -886,10 +1088,7 @@ class ORM:
             return url_filters
 
     async def update_urlfilters_global(self, guild_id, game_id, service_id, filters):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-            await conn.execute("PRAGMA foreign_keys = 1")
-
+        async with self._write(foreign_keys=True) as conn:
             # Clean any existing filters
             query = "DELETE FROM url_filters WHERE follower_guild_id = ? AND game_id = ? AND service_id = ?;"
             params = (guild_id, game_id, service_id)
@@ -901,12 +1100,10 @@ class ORM:
             params = (guild_id, game_id, service_id, filters, None, None)
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_routes()
 
     async def update_urlfilters_channel(self, guild_id, game_id, service_id, filters, channel_id=None, thread_id=None):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-            await conn.execute("PRAGMA foreign_keys = 1")
-
+        async with self._write(foreign_keys=True) as conn:
             # Insert new filters
             if channel_id:
                 query = """
@@ -939,18 +1136,27 @@ class ORM:
                 return
 
             await conn.commit()
+            self._invalidate_routes()
 
     async def clear_urlfilters(self, guild_id, game_id, service_id):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.set_trace_callback(logger.debug)
-            await conn.execute("PRAGMA foreign_keys = 1")
-
+        async with self._write(foreign_keys=True) as conn:
             # Clean any existing filters
             query = "DELETE FROM url_filters WHERE follower_guild_id = ? AND game_id = ? AND service_id = ?;"
             params = (guild_id, game_id, service_id)
             await conn.execute(query, params)
             await conn.commit()
+            self._invalidate_routes()
 
     async def close_connection(self):
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.close()
+        if self._writer:
+            try:
+                await self.flush_last_posts()
+            except Exception as e:
+                logger.error(f'Could not flush last posts: {e}')
+            await self._writer.close()
+            self._writer = None
+
+        while not self._readers.empty():
+            reader = self._readers.get_nowait()
+            await reader.close()
+        logger.info('Database connections closed.')
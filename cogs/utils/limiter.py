@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger('bot.utils.AdaptiveLimiter')
+
+
+class AdaptiveLimiter:
+    """ Concurrency limit adapting to the upstream health (AIMD).
+
+    Each fast and successful call raises the limit by `1 / limit` (so about +1 per full round),
+    a failure or a call slower than `latency_target` halves it, at most once per `latency_target`
+    seconds so a single slow burst doesn't collapse it to the minimum.
+
+    Usage:
+        async with limiter:
+            ...
+        limiter.record(latency, ok)
+    """
+
+    def __init__(self, name, max_limit, min_limit=1, latency_target=2.0, backoff=0.5):
+        self.name = name
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+
+        self.limit = float(max(min_limit, self.max_limit // 2))
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def record(self, latency, ok):
+        now = time.monotonic()
+        if not ok or latency > self.latency_target:
+            if now - self._last_decrease > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                logger.debug(f'{self.name}: Limit decreased to {int(self.limit)} (latency: {latency:.2f}s, ok: {ok}).')
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
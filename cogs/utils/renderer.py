@@ -0,0 +1,510 @@
+# Posts content rendering, from the API HTML to the markdown of embeds.
+# It's CPU bound (BeautifulSoup, markdownify and regexes), `render()` runs it in a pool so a burst
+# of long posts doesn't block the event loop. Inputs and outputs are plain strings, any pool works.
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+
+from bs4 import BeautifulSoup, NavigableString
+
+import sec
+from cogs.utils.emojimapper import EmojiMapper
+from cogs.utils import mardownify_discord as md
+from cogs.utils import stream_renderer
+
+logger = logging.getLogger('bot.Renderer')
+
+# Enforced by the Discord API
+EMBEDS_MAX_DESC = 4096
+
+# `process` (default) renders on several cores, `thread` only keeps the event loop free
+# but is cheaper, `none` renders inline on the event loop.
+RENDER_POOL = sec.load('render_pool') or 'process'
+RENDER_WORKERS = int(sec.load('render_workers') or min(4, os.cpu_count() or 1))
+# Maximum size (in characters) of the rendered posts kept in cache
+RENDER_CACHE_SIZE = int(sec.load('render_cache_size') or 4 * 1024 * 1024)
+# `soup` (default) renders with BeautifulSoup and markdownify, `stream` in a single pass with
+# stream_renderer.py, falling back to `soup` for the posts it can't render the same way.
+RENDER_ENGINE = sec.load('render_engine') or 'soup'
+
+if RENDER_ENGINE == 'stream' and stream_renderer.UNSUPPORTED_VERSIONS:
+    logger.warning(f'Stream rendering disabled, unsupported versions: {", ".join(stream_renderer.UNSUPPORTED_VERSIONS)}.')
+
+EM = EmojiMapper()
+
+MD_OPTIONS = {'bullets': '-', 'strip': ['img']}
+MD_CONVERTER = md.DiscordMarkdownConverted(**MD_OPTIONS)
+
+# Only `<br>` tags are handled without parsing, see split_plain_text()
+PLAIN_TEXT_BREAK_RE = re.compile(r'<br\s*/?>', re.IGNORECASE)
+# Same as markdownify text nodes whitespaces normalization
+PLAIN_TEXT_WHITESPACES_RE = re.compile(r'[\t ]+')
+# See normalize_body()
+BLANK_LINES_RE = re.compile(r'\n\s*\n')
+QUOTE_LINES_RE = re.compile(r'\n>(?:\s*\n>){2,}')
+
+
+
+class RenderCache:
+    """ LRU of rendered posts, bounded by the size of their rendered content.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        rendered = self._entries.get(key)
+        if rendered is not None:
+            self._entries.move_to_end(key)
+        return rendered
+
+    def put(self, key, rendered):
+        if key in self._entries:
+            return
+
+        self._entries[key] = rendered
+        self.size += self._sizeof(rendered)
+        while self.size > self.max_size and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= self._sizeof(evicted)
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    @staticmethod
+    def _sizeof(rendered):
+        description, img_url = rendered
+        return len(description) + len(img_url or '')
+
+
+CACHE = RenderCache(RENDER_CACHE_SIZE)
+
+_executor = None
+_inflight = {}
+
+
+def start():
+    """ Create the pool, workers of a process pool are started on the first renders.
+    """
+    global _executor
+    if _executor or RENDER_POOL == 'none':
+        return _executor
+
+    if RENDER_POOL == 'process':
+        # Forking the bot could copy locks held by its other threads (sentry, aiosqlite...), workers
+        # are forked from a single-threaded server instead, which has this module already imported.
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context('forkserver')
+            mp_context.set_forkserver_preload([__name__])
+        else:
+            mp_context = multiprocessing.get_context('spawn')
+        _executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=mp_context)
+    else:
+        _executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix='renderer')
+    logger.info(f'{RENDER_POOL.capitalize()} pool started ({RENDER_WORKERS} workers).')
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def render(post_id, post_content, origin=None, strip_blockquotes=False):
+    """ `(description, img_url)` of a post, rendered once in the pool then served from the cache.
+    """
+    key = _cache_key(post_id, post_content, origin, strip_blockquotes)
+
+    rendered = CACHE.get(key)
+    if rendered is not None:
+        CACHE.hits += 1
+        return rendered
+
+    # Another caller is already rendering it
+    if key in _inflight:
+        CACHE.hits += 1
+        return await asyncio.shield(_inflight[key])
+
+    CACHE.misses += 1
+    fut = asyncio.ensure_future(_render(post_content, origin, strip_blockquotes))
+    _inflight[key] = fut
+
+    def _done(f):
+        _inflight.pop(key, None)
+        if not f.cancelled() and not f.exception():
+            CACHE.put(key, f.result())
+
+    fut.add_done_callback(_done)
+    return await asyncio.shield(fut)
+
+
+def _cache_key(post_id, post_content, origin, strip_blockquotes):
+    h = hashlib.blake2b(digest_size=16)
+    for part in (str(post_id), post_content, str(origin), str(strip_blockquotes)):
+        h.update(part.encode())
+        h.update(b'\0')
+    return h.digest()
+
+
+async def _render(post_content, origin, strip_blockquotes):
+    executor = start()
+    if not executor:
+        return sanitize_post_content(post_content, origin, strip_blockquotes)
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, sanitize_post_content, post_content, origin, strip_blockquotes)
+    except BrokenProcessPool:
+        # A worker died (killed, out of memory...), the pool refuses every job until it's replaced
+        logger.error('Process pool broken, restarting it.')
+        _discard(executor)
+
+    executor = start()
+    try:
+        return await loop.run_in_executor(executor, sanitize_post_content, post_content, origin, strip_blockquotes)
+    except BrokenProcessPool:
+        logger.error('Process pool broken again, rendering inline.')
+        _discard(executor)
+        return sanitize_post_content(post_content, origin, strip_blockquotes)
+
+
+def _discard(executor):
+    """ Drop a broken pool, unless the renders it failed at the same time already replaced it.
+    """
+    if executor is _executor:
+        shutdown()
+
+
+def find_img(soup: BeautifulSoup):
+    imgs = soup.find_all('img')
+
+    if not imgs:
+        return None
+
+    # Last img first
+    imgs.reverse()
+    for img in imgs:
+        if 'src' not in img:
+            # I don't even know how it happens but it happens
+            continue
+        if 'icon' in img['src'] and '.gif' in img['src']:
+            # Some services use old .gif emojis, in the future it would probably
+            # be better to check for a minimal size.
+            continue
+        else:
+            # Force HTTPS url scheme
+            return re.sub(r"^\/\/", 'https://', img['src'])
+    return None
+
+
+def ellipsise_blockquotes(soup: BeautifulSoup, nb_char_overflow):
+    """ Replace the end of blockquotes by `[...]` until `nb_char_overflow` characters are stripped.
+
+    Blockquotes and paragraphs of the current one are kept up to date as nodes are removed, instead
+    of being searched again after each removal, so long quoted threads are trimmed in linear time.
+    """
+    i = 0
+    bqs = soup.find_all('blockquote')
+    # Set when removed paragraphs contained blockquotes, `bqs` must then be searched again
+    bqs_stale = False
+    nb_char_stripped = 0
+    last_processed_bq = False
+
+    bq = None
+    bq_ps = []
+
+    nb_blocquotes = len(bqs)
+    # We try to remove the less text possible, ellipsising is interrupted as soon as we can
+    while i < nb_blocquotes and nb_char_overflow > nb_char_stripped:
+        if bqs[i] is not bq:
+            bq = bqs[i]
+            bq_ps = bq.find_all('p')
+            # Without nested paragraphs or blockquotes, the trimming can be computed from the paragraphs sizes
+            bq_flat = not any(p.find(['p', 'blockquote']) for p in bq_ps)
+
+        # Paragraphs are only removed from here, `bq` keeps less than two until it changes
+        if len(bq_ps) < 2:
+
+            # Prevent useless loop
+            if len(bqs) < 1:
+                nb_blocquotes = 0
+                break
+
+            if bqs[-1].string == '[...]':
+                bqs[-1].decompose()
+                nb_char_stripped += 5
+                logger.debug(f"{nb_char_stripped} chars stripped.")
+                bqs.pop()
+            elif len(bqs) > 1:
+                ellipsis = soup.new_tag('blockquote')
+                ellipsis.string = '[...]'
+                nb_char_stripped += len(bqs[-1].text) - 5
+                bqs[-1].decompose()
+                bqs[-2].insert_after(ellipsis)
+                logger.debug(f"{nb_char_stripped} chars stripped.")
+                bqs[-1] = ellipsis
+            elif len(bqs) == 1:
+                nb_char_stripped += len(bqs[-1].text)
+                bqs[-1].decompose()
+                nb_blocquotes = 0
+                break
+            else:
+                logger.error("Useless stripping loop !")
+                break
+
+            if bqs_stale:
+                bqs = soup.find_all('blockquote')
+                bqs_stale = False
+            nb_blocquotes = len(bqs)
+            continue
+
+        if len(bq_ps) > 2 and bq_flat:
+            # Same result as removing the last two paragraphs and moving the ellipsis one at a time,
+            # the kept paragraphs are `bq_ps[:nb_kept]`
+            nb_kept = len(bq_ps) - 1
+            last_p_size = len(bq_ps[-1].text)
+            while nb_kept > 1 and nb_char_overflow > nb_char_stripped:
+                nb_char_stripped += last_p_size + len(bq_ps[nb_kept - 1].text) - 5
+                last_p_size = 5
+                nb_kept -= 1
+
+            for p in bq_ps[nb_kept:]:
+                p.decompose()
+            ellipsis = soup.new_tag('p')
+            ellipsis.string = '[...]'
+            bq_ps[nb_kept - 1].insert_after(ellipsis)
+            last_processed_bq = bq
+            bq_ps = bq_ps[:nb_kept] + [ellipsis]
+            continue
+
+        # Measured before removal, decomposed nodes are emptied
+        last_p, prev_p = bq_ps[-1], bq_ps[-2]
+        bqs_stale = bqs_stale or bool(last_p.find('blockquote'))
+
+        ellipsis = soup.new_tag('p')
+        ellipsis.string = '[...]'
+        if len(bq_ps) > 2:
+            bqs_stale = bqs_stale or bool(prev_p.find('blockquote'))
+            nb_char_removed = len(prev_p.text)
+            if prev_p not in last_p.parents:
+                nb_char_removed += len(last_p.text)
+
+        last_p.decompose()
+        prev_p.insert_after(ellipsis)
+        if len(bq_ps) > 2:
+            # Delete last two nodes and reinsert ellipsis
+            last_p.decompose()
+            prev_p.decompose()
+            bq_ps[-3].insert_after(ellipsis)
+            nb_char_stripped += nb_char_removed - len(ellipsis.string)
+            last_processed_bq = bq
+            bq_ps = bq_ps[:-2] + [ellipsis]
+        else:
+            i += 1
+            continue
+
+    # Ensure Ellipsis
+    if last_processed_bq:
+        last_p = last_processed_bq.findAll('p')[-1]
+        if last_p.text != '[...]':
+            if last_p.string:
+                last_p.string.replace_with('[...]')
+            else:
+                last_p.append(NavigableString('[...]'))
+
+        logger.debug(str(nb_char_stripped) + ' characters stripped from blockquotes')
+
+
+def sanitize_post_content(post_content, origin=None, strip_blockquotes=False):
+
+    if origin not in ['Twitter', ]:
+        post_content = post_content.replace('\n', '')
+
+    # Fix Missing emojis
+    post_content = EM._replace_emoji_shortcodes(post_content)
+
+    # Most tweets and short posts have no markup, they don't need the whole DOM pipeline
+    text_parts = split_plain_text(post_content)
+    if text_parts is not None:
+        body = plain_text_to_markdown(text_parts)
+        img_url = None
+    elif RENDER_ENGINE == 'stream':
+        try:
+            body, img_url = stream_renderer.html_to_markdown(post_content, MD_CONVERTER, origin=origin, max_prettified_size=EMBEDS_MAX_DESC)
+        except stream_renderer.Unsupported as e:
+            logger.debug(f'Stream rendering not supported ({e}), using BeautifulSoup.')
+            body, img_url = html_to_markdown(post_content, origin=origin, strip_blockquotes=strip_blockquotes)
+    else:
+        body, img_url = html_to_markdown(post_content, origin=origin, strip_blockquotes=strip_blockquotes)
+
+    body_trimmed = normalize_body(body)
+
+    description = (body_trimmed[:EMBEDS_MAX_DESC - 15] + '...\n\n[...]') if len(body_trimmed) > EMBEDS_MAX_DESC else body_trimmed
+
+    return description, img_url
+
+
+def normalize_body(body):
+    """ Max 2 new lines in a row, and max 2 lines in a row in blockquotes, in two scans of the body.
+
+    The output is the same as replacing `\\n\\s*\\n` by `\\n\\n`, then runs of four `\\n>` lines (separated
+    by whitespaces only) by `\\n> \\n> ` until there's none left, then runs of three once.
+    """
+    body = BLANK_LINES_RE.sub('\n\n', body)
+    # Each run is collapsed on its own, the rest of the body isn't rewritten
+    return QUOTE_LINES_RE.sub(_collapse_quote_run, body)
+
+
+def _collapse_quote_run(match):
+    # Whitespaces between the `\n>` of the run
+    gaps = match.group().split('\n>')[1:-1]
+
+    # Whitespaces after the last `\n>`
+    tail = ''
+    while len(gaps) >= 3:
+        gaps, tail = _collapse_quote_lines(gaps, tail, 4)
+    if len(gaps) == 2:
+        gaps, tail = _collapse_quote_lines(gaps, tail, 3)
+
+    return '\n>' + ''.join(gap + '\n>' for gap in gaps) + tail
+
+
+def _collapse_quote_lines(gaps, tail, nb_lines):
+    """ Whitespaces left once each group of `nb_lines` blockquote lines is replaced by `\\n> \\n> `.
+    """
+    nb_groups = (len(gaps) + 1) // nb_lines
+
+    collapsed = []
+    for i in range(nb_groups):
+        if i:
+            collapsed.append(' ' + gaps[i * nb_lines - 1])
+        collapsed.append(' ')
+
+    # Lines after the last group are kept, the replacement ends with a space
+    rest = gaps[nb_groups * nb_lines - 1:]
+    if rest:
+        collapsed.append(' ' + rest[0])
+        collapsed.extend(rest[1:])
+    else:
+        tail = ' ' + tail
+    return collapsed, tail
+
+
+def split_plain_text(post_content):
+    """ Text between the `<br>` of a content without any other markup nor entity, None if it has some.
+    """
+    text_parts = PLAIN_TEXT_BREAK_RE.split(post_content)
+    if any('<' in part or '&' in part for part in text_parts):
+        return None
+    return text_parts
+
+
+def plain_text_to_markdown(text_parts):
+    """ Same markdown as markdownify for text nodes separated by `<br>`.
+    """
+    markdown_parts = []
+    for part in text_parts:
+        # Like BeautifulSoup, which replaces whitespace only strings by a single space or new line
+        if part and not part.strip(BeautifulSoup.ASCII_SPACES):
+            part = '\n' if '\n' in part else ' '
+        markdown_parts.append(MD_CONVERTER.escape(PLAIN_TEXT_WHITESPACES_RE.sub(' ', part)))
+
+    line_break = MD_CONVERTER.convert_br(None, '', False)
+    return line_break.join(markdown_parts)
+
+
+def html_to_markdown(post_content, origin=None, strip_blockquotes=False):
+
+    soup = BeautifulSoup(post_content, "html.parser")
+
+    # Only blockquotes are stripped to fit the limit, no need to measure posts without any
+    nb_char_overflow = 0
+    if soup.find('blockquote'):
+        nb_char_overflow = len(soup.prettify()) - EMBEDS_MAX_DESC
+
+    if strip_blockquotes and nb_char_overflow > 0:
+        for blockquote in soup.find_all('blockquote'):
+            blockquote.decompose()
+
+    # Fix links from CommLink
+    if origin in ['CommLink']:
+        for a in soup.find_all('a'):
+            has_u = False
+            has_i = False
+            has_b = False
+            if a.has_attr('href') and a['href'].startswith('\"'):
+                a['href'] = a['href'][1:-1]
+
+            if a.text:
+                backup_txt = a.get_text()
+                for t in a.children:
+                    if t.name == 'u':
+                        t.decompose()
+                        has_u = True
+                    if t.name == 'i':
+                        t.decompose()
+                        has_i = True
+                    if t.name == 'b' or t.name == 'strong':
+                        t.decompose()
+                        has_b = True
+                    a.string = backup_txt
+
+            if has_u:
+                nt = soup.new_tag("u")
+                c = a.replace_with(nt)
+                nt.append(c)
+            if has_i:
+                nt = soup.new_tag("i")
+                c = a.replace_with(nt)
+                nt.append(c)
+            if has_b:
+                nt = soup.new_tag("b")
+                c = a.replace_with(nt)
+                nt.append(c)
+
+
+    # Fix blockquote from Spectrum
+    if origin in ['rsi', 'Bungie.net']:
+        for quoteauthor in soup.find_all('div', {'class': 'quoteauthor'}):
+            quoteauthor.insert_after(soup.new_tag("br"))
+            quoteauthor.insert_after(soup.new_tag("br"))
+
+    # Fix blockquote from Reddit
+    if origin in ['Reddit', 'Steam']:
+        for quoteauthor in soup.find_all('div', {'class': 'bb_quoteauthor'}):
+            quoteauthor.insert_after(soup.new_tag("br"))
+            quoteauthor.insert_after(soup.new_tag("br"))
+
+    # Fix blockquote from Twitter
+    if origin == 'Twitter':
+        for quoteblock in soup.find_all('blockquote'):
+            quoteauthor = quoteblock.next_element
+            quoteauthor.insert_after(soup.new_tag("br"))
+            quoteauthor.insert_after(soup.new_tag("br"))
+            quoteauthor.insert_before("Originally posted by ")
+
+    # Ellipsising Blocquotes
+    if nb_char_overflow > 0:
+        ellipsise_blockquotes(soup, nb_char_overflow)
+
+    # HTML -> Markdown
+    body = md.markdownify(soup, **MD_OPTIONS)
+
+    return body, find_img(soup)
@@ -0,0 +1,430 @@
+# Single pass rendering of the posts HTML, the `stream` engine of renderer.py.
+# html.parser events build light elements, each one is converted by the Discord markdown converter as soon
+# as its parent is closed (markdownify needs the siblings of a node), while the per-origin fixes and the image
+# lookup are applied on the way. The tree is never walked again.
+# Markup which can't be rendered exactly like the BeautifulSoup pipeline raises `Unsupported`, the caller
+# then falls back to it.
+from importlib import metadata
+import re
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+from bs4.builder import HTMLParserTreeBuilder
+from bs4.dammit import EntitySubstitution
+
+# Versions whose internals are mirrored here (tree builder rules, markdownify `process_text`,
+# `should_convert_tag` and `convert_*` signatures), any other one falls back to the other engine.
+SUPPORTED_VERSIONS = {
+    'beautifulsoup4': '4.15.0',
+    'markdownify': '0.13.1',
+}
+
+
+def _installed_version(package):
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+UNSUPPORTED_VERSIONS = [
+    f'{package} {_installed_version(package)} (supported: {version})'
+    for package, version in SUPPORTED_VERSIONS.items()
+    if _installed_version(package) != version
+]
+
+# Parsing rules of the BeautifulSoup builder used by the other engine
+BUILDER = HTMLParserTreeBuilder()
+
+# Raw text tags have their own kind of text nodes, tables are converted with a look at the whole tree
+UNSUPPORTED_TAGS = {
+    'script', 'style', 'template', 'rt', 'rp',
+    'table', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th',
+}
+# Whitespace only text nodes are removed from those by markdownify
+NESTED_TAGS = {'ol', 'ul', 'li', 'table', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th'}
+HEADING_RE = re.compile(r'h[1-6]')
+
+QUOTE_AUTHOR_CLASSES = {
+    'rsi': 'quoteauthor',
+    'Bungie.net': 'quoteauthor',
+    'Reddit': 'bb_quoteauthor',
+    'Steam': 'bb_quoteauthor',
+}
+
+
+class Unsupported(Exception):
+    pass
+
+
+class Text(str):
+    """ Text node, with the attributes markdownify reads on BeautifulSoup ones.
+    """
+    name = None
+    parent = None
+    next_sibling = None
+
+    def find_parent(self, names):
+        return find_parent(self, names)
+
+
+class Comment(Text):
+    pass
+
+
+class Element:
+    """ Tag, with the attributes markdownify reads on BeautifulSoup ones.
+    """
+
+    def __init__(self, name, attrs, parent, inline):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.contents = []
+        self.next_sibling = None
+        # `convert_as_inline` of markdownify for this tag and its children
+        self.inline = inline
+        self.children_inline = inline or bool(HEADING_RE.match(name)) or name in ['td', 'th']
+        # Markdown of the children, set once closed
+        self.text = ''
+        # First node of a Twitter blockquote, followed by two line breaks
+        self.quote_author = False
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def index(self, element):
+        for i, child in enumerate(self.contents):
+            if child is element:
+                return i
+        raise ValueError('Element not in contents.')
+
+    def find_parent(self, names):
+        return find_parent(self, names)
+
+    def append(self, node):
+        node.parent = self
+        self.contents.append(node)
+        return node
+
+
+def find_parent(node, names):
+    if isinstance(names, str):
+        names = [names]
+    parent = node.parent
+    while parent is not None:
+        if parent.name in names:
+            return parent
+        parent = parent.parent
+    return None
+
+
+def html_to_markdown(post_content, converter, origin=None, max_prettified_size=None):
+    """ `(body, img_url)` of a post, rendered in a single pass.
+
+    Blockquotes are ellipsised when the prettified HTML is longer than `max_prettified_size`, which
+    raises `Unsupported` if it may happen, like any post when the installed versions aren't supported.
+    """
+    if UNSUPPORTED_VERSIONS:
+        raise Unsupported(f'Unsupported versions: {", ".join(UNSUPPORTED_VERSIONS)}.')
+
+    renderer = StreamRenderer(converter, origin=origin)
+    renderer.feed(post_content)
+    renderer.close()
+
+    if renderer.has_blockquote and max_prettified_size is not None and renderer.max_prettified_size > max_prettified_size:
+        raise Unsupported('Blockquotes may have to be ellipsised.')
+
+    return renderer.root.text, renderer.img_url
+
+
+class StreamRenderer(HTMLParser):
+    """ Builds the same tree as the `html.parser` builder of BeautifulSoup, converted to markdown as it goes.
+    """
+
+    def __init__(self, converter, origin=None):
+        super().__init__(convert_charrefs=False)
+        self.converter = converter
+        self.origin = origin
+        self.quote_author_class = QUOTE_AUTHOR_CLASSES.get(origin)
+
+        self.root = Element(BeautifulSoup.ROOT_TAG_NAME, {}, None, False)
+        self.stack = [self.root]
+        self.open_tags = {}
+        self.already_closed_empty_element = []
+        self.data = []
+        # Open tags whose text nodes whitespaces are kept as is
+        self.nb_preserve_whitespace = 0
+
+        self.img_url = None
+        self.has_blockquote = False
+        # Upper bound of `len(soup.prettify())`
+        self.max_prettified_size = 0
+        # Twitter blockquotes whose first node is not parsed yet
+        self.pending_quote = False
+
+    # ---------------------------------------------------------------------------------
+    # PARSER EVENTS
+    # ---------------------------------------------------------------------------------
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, handle_empty_element=False)
+        self.handle_endtag(tag, check_already_closed=False)
+
+    def handle_starttag(self, tag, attrs, handle_empty_element=True):
+        self.end_data()
+
+        if tag in UNSUPPORTED_TAGS:
+            raise Unsupported(f'<{tag}> tag.')
+        if tag == 'a' and self.origin == 'CommLink' and self.open_tags.get('a'):
+            raise Unsupported('Nested links from CommLink.')
+
+        attr_dict = {}
+        for key, value in attrs:
+            attr_dict[key] = '' if value is None else value
+
+        parent = self.stack[-1]
+        element = Element(tag, attr_dict, parent, parent.children_inline)
+        self.add_node(element)
+        self.stack.append(element)
+        self.open_tags[tag] = self.open_tags.get(tag, 0) + 1
+        if tag in BUILDER.preserve_whitespace_tags:
+            self.nb_preserve_whitespace += 1
+
+        self.max_prettified_size += 2 * (len(self.stack) + len(tag)) + 6
+        for key, value in attr_dict.items():
+            self.max_prettified_size += len(key) + 4 + prettified_size(value, True)
+
+        if tag == 'blockquote':
+            self.has_blockquote = True
+            if self.origin == 'Twitter':
+                self.pending_quote = True
+
+        if tag in BUILDER.empty_element_tags and handle_empty_element:
+            self.handle_endtag(tag, check_already_closed=False)
+            self.already_closed_empty_element.append(tag)
+
+    def handle_endtag(self, tag, check_already_closed=True):
+        if check_already_closed and tag in self.already_closed_empty_element:
+            self.already_closed_empty_element.remove(tag)
+            return
+
+        self.end_data()
+        if not self.open_tags.get(tag):
+            return
+        while True:
+            element = self.pop()
+            if element.name == tag:
+                break
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_charref(self, name):
+        try:
+            numeric = int(name[1:], 16) if name[:1] in 'xX' else int(name)
+        except ValueError:
+            raise Unsupported(f'&#{name}; character reference.')
+        # Replaced by BeautifulSoup
+        if numeric == 0 or 0x80 <= numeric <= 0x9f or 0xd800 <= numeric <= 0xdfff or numeric > 0x10ffff:
+            raise Unsupported(f'&#{name}; character reference.')
+        self.handle_data(chr(numeric))
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        # Like BeautifulSoup, unknown entities are literal strings such as `Q&A`
+        self.handle_data(f'&{name}' if character is None else character)
+
+    def handle_comment(self, data):
+        self.end_data()
+        self.handle_data(data)
+        self.end_data(Comment)
+        self.max_prettified_size += 7
+
+    def handle_decl(self, decl):
+        raise Unsupported('Declaration.')
+
+    def unknown_decl(self, data):
+        raise Unsupported('Declaration.')
+
+    def handle_pi(self, data):
+        raise Unsupported('Processing instruction.')
+
+    def close(self):
+        super().close()
+        self.end_data()
+        while len(self.stack) > 1:
+            self.pop()
+        self.close_element(self.root)
+
+    # ---------------------------------------------------------------------------------
+    # TREE
+    # ---------------------------------------------------------------------------------
+
+    def end_data(self, node_class=Text):
+        if not self.data:
+            return
+
+        data = ''.join(self.data)
+        self.data = []
+        # Like BeautifulSoup, which replaces whitespace only strings by a single space or new line
+        if not self.nb_preserve_whitespace and not data.strip(BeautifulSoup.ASCII_SPACES):
+            data = '\n' if '\n' in data else ' '
+
+        self.add_node(node_class(data))
+        self.max_prettified_size += len(self.stack) + 1 + prettified_size(data)
+
+    def add_node(self, node):
+        parent = self.stack[-1]
+
+        if not self.pending_quote:
+            return parent.append(node)
+
+        # Twitter blockquotes are prefixed with the author, which is their first node
+        self.pending_quote = False
+        parent.append(Text('Originally posted by '))
+        parent.append(node)
+        if isinstance(node, Element):
+            node.quote_author = True
+        else:
+            self.add_line_breaks(parent)
+        return node
+
+    def add_line_breaks(self, parent):
+        for _ in range(2):
+            parent.append(Element('br', {}, parent, parent.children_inline))
+
+    def pop(self):
+        if self.pending_quote:
+            raise Unsupported('Empty blockquote from Twitter.')
+
+        element = self.stack.pop()
+        self.open_tags[element.name] -= 1
+        if element.name in BUILDER.preserve_whitespace_tags:
+            self.nb_preserve_whitespace -= 1
+
+        if element.name == 'a' and self.origin == 'CommLink':
+            self.close_element(self.fix_commlink(element))
+        else:
+            self.close_element(element)
+
+        if element.name == 'img':
+            self.find_img(element)
+
+        if element.quote_author:
+            self.add_line_breaks(element.parent)
+        elif element.name == 'div' and self.quote_author_class and self.quote_author_class in element.get('class', '').split():
+            self.add_line_breaks(element.parent)
+
+        return element
+
+    def close_element(self, element):
+        """ Markdown of the children, with the same conversions as markdownify's `process_tag()`.
+        """
+        contents = element.contents
+
+        if element.name in NESTED_TAGS:
+            i = 0
+            # Same removals as markdownify, whose loop skips the node following a removed one
+            while i < len(contents):
+                node = contents[i]
+                previous_node = contents[i - 1] if i > 0 else None
+                next_node = contents[i + 1] if i + 1 < len(contents) else None
+                can_extract = (not previous_node
+                               or not next_node
+                               or is_nested_node(previous_node)
+                               or is_nested_node(next_node))
+                if isinstance(node, Text) and node.strip() == '' and can_extract:
+                    del contents[i]
+                i += 1
+
+        for i in range(len(contents) - 1):
+            contents[i].next_sibling = contents[i + 1]
+
+        parts = []
+        for node in contents:
+            if isinstance(node, Comment):
+                continue
+            elif isinstance(node, Text):
+                parts.append(self.converter.process_text(node))
+            else:
+                parts.append(self.convert(node))
+        element.text = ''.join(parts)
+
+    def convert(self, element):
+        convert_fn = getattr(self.converter, f'convert_{element.name}', None)
+        if convert_fn and self.converter.should_convert_tag(element.name):
+            return convert_fn(element, element.text, element.inline)
+        return element.text
+
+    # ---------------------------------------------------------------------------------
+    # ORIGIN FIXES
+    # ---------------------------------------------------------------------------------
+
+    def fix_commlink(self, a):
+        """ Same as the CommLink links fix of `renderer.html_to_markdown()`, returns the wrapping tag if any.
+        """
+        href = a.get('href')
+        if href is not None and href.startswith('\"'):
+            a.attrs['href'] = href[1:-1]
+
+        text = get_text(a)
+        if not text:
+            return a
+
+        # Only the first child is looked at, the children are replaced by the text right after
+        wrapper_name = None
+        first_name = a.contents[0].name
+        if first_name in ['u', 'i']:
+            wrapper_name = first_name
+        elif first_name in ['b', 'strong']:
+            wrapper_name = 'b'
+
+        a.contents = []
+        a.append(Text(text))
+        if not wrapper_name:
+            return a
+
+        parent = a.parent
+        wrapper = Element(wrapper_name, {}, parent, a.inline)
+        parent.contents[parent.index(a)] = wrapper
+        self.close_element(a)
+        wrapper.append(a)
+        return wrapper
+
+    def find_img(self, img):
+        """ Same checks as `renderer.find_img()`, the last image matching them is kept.
+        """
+        if 'src' not in img.contents:
+            return
+        src = img.get('src', '')
+        if 'icon' in src and '.gif' in src:
+            return
+        self.img_url = re.sub(r"^\/\/", 'https://', src)
+
+
+def is_nested_node(node):
+    return node and node.name in NESTED_TAGS
+
+
+def get_text(element):
+    """ Text nodes of an element, without its comments.
+    """
+    parts = []
+    for node in element.contents:
+        if isinstance(node, Comment):
+            continue
+        elif isinstance(node, Text):
+            parts.append(node)
+        else:
+            parts.append(get_text(node))
+    return ''.join(parts)
+
+
+def prettified_size(text, attribute=False):
+    """ Upper bound of the size of `text` once escaped by `prettify()`.
+    """
+    nb_escaped = text.count('&') + text.count('<') + text.count('>')
+    if attribute:
+        nb_escaped += text.count('"')
+    return len(text) + 5 * nb_escaped
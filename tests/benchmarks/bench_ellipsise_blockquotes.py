@@ -0,0 +1,36 @@
+# Trimming time of the longest quoted threads with renderer.ellipsise_blockquotes(), against
+# the previous loop that searched the blockquotes and paragraphs again after each removal.
+# Run with `python -m tests.benchmarks.bench_ellipsise_blockquotes`.
+import time
+
+from bs4 import BeautifulSoup
+
+from cogs.utils import renderer
+from tests import references
+from tests.payloads import QUOTED_WORST_CASES
+
+
+def measure(ellipsise, content, nb_runs=3):
+    durations = []
+    for _ in range(nb_runs):
+        # The soup is trimmed in place, each run needs a fresh one
+        soup = BeautifulSoup(content, 'html.parser')
+        start = time.perf_counter()
+        ellipsise(soup, 10 ** 7)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def main():
+    implementations = {
+        'previous': references.ellipsise_blockquotes,
+        'current': renderer.ellipsise_blockquotes,
+    }
+    for name, content in QUOTED_WORST_CASES.items():
+        print(f'{name}:')
+        for label, ellipsise in implementations.items():
+            print(f'  {label:<10} {measure(ellipsise, content) * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
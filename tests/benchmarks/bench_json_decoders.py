@@ -0,0 +1,31 @@
+# Decoding time of a posts feed with each decoder of `api.get_json_loads()`, against the
+# `resp.json()` of aiohttp (text decoding then `json.loads`).
+# Run with `python -m tests.benchmarks.bench_json_decoders`.
+import json
+import timeit
+
+from cogs.utils import api
+from tests.payloads import make_posts_body
+
+
+def aiohttp_json(body):
+    return json.loads(body.decode('utf-8'))
+
+
+def main():
+    decoders = {
+        'resp.json()': aiohttp_json,
+        'json': api.get_json_loads('json'),
+        'orjson': api.get_json_loads('orjson'),
+    }
+    for nb_posts, content_size in [(20, 500), (50, 2000), (200, 4000)]:
+        body = make_posts_body(nb_posts, content_size)
+        print(f'{nb_posts} posts, {len(body) // 1024} KiB:')
+        for name, loads in decoders.items():
+            nb_runs = 50
+            duration = min(timeit.repeat(lambda: loads(body), number=nb_runs, repeat=5)) / nb_runs
+            print(f'  {name:<12} {duration * 1000:.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
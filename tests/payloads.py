@@ -0,0 +1,161 @@
+# Synthetic API payloads, shaped like the `/posts` responses of the DevTracker API.
+import json
+import random
+
+SERVICES = ['Twitter', 'Reddit', 'rsi', 'Steam', 'CommLink']
+WORDS = ['patch', 'notes', 'server', 'fix', 'update', 'the', 'bug', 'known', 'issue', 'players', 'quest', 'é', '&', '<']
+
+
+def make_post(rnd, post_id, timestamp, content_size):
+    words = []
+    size = 0
+    while size < content_size:
+        word = rnd.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    paragraphs = [' '.join(words[i:i + 40]) for i in range(0, len(words), 40)]
+    service = rnd.choice(SERVICES)
+    return {
+        'id': post_id,
+        'timestamp': timestamp,
+        'topic': f'Topic {post_id}',
+        'url': f'https://example.com/posts/{post_id}',
+        'content': ''.join(f'<p>{p}</p>' for p in paragraphs),
+        'account': {
+            'identifier': f'dev{rnd.randint(1, 20)}',
+            'service': service,
+            'developer': {'nick': 'Dev', 'group': 'Team'},
+        },
+    }
+
+
+def make_posts_payload(nb_posts=50, content_size=2000, seed=0):
+    """ Posts of a game feed, latest first, as returned by the API.
+    """
+    rnd = random.Random(seed)
+    posts = [make_post(rnd, f'post{i}', 1700000000 - i * 60, content_size) for i in range(nb_posts)]
+    return {'data': posts}
+
+
+def make_posts_body(nb_posts=50, content_size=2000, seed=0):
+    """ Raw response body of `make_posts_payload()`.
+    """
+    return json.dumps(make_posts_payload(nb_posts, content_size, seed)).encode()
+
+
+# Longest runs of renderer.ellipsise_blockquotes(), long quoted threads
+QUOTED_WORST_CASES = {
+    '800 single-paragraph quotes': ''.join(f'<blockquote><p>{"x" * 30}</p></blockquote>' for _ in range(800)),
+    'one quote with 1500 paragraphs': '<blockquote>' + ''.join(f'<p>{"y" * 20}</p>' for _ in range(1500)) + '</blockquote>',
+    '300 nested quotes': '<blockquote>' * 300 + 'z' * 50 + '</blockquote>' * 300,
+}
+QUOTED_WORDS = ['a', 'bb', 'ccc', '[...]', 'dddd eeee']
+
+
+def make_quoted_content(rnd, depth=0):
+    """ Random mix of text, paragraphs, blockquotes (nested, or already ellipsised) and divs.
+    """
+    out = []
+    for _ in range(rnd.randint(0, 5 if depth < 3 else 1)):
+        kind = rnd.random()
+        if kind < 0.3:
+            out.append(rnd.choice(QUOTED_WORDS))
+        elif kind < 0.6:
+            if rnd.random() < 0.2:
+                inner = make_quoted_content(rnd, depth + 1)
+            else:
+                inner = rnd.choice(QUOTED_WORDS) * rnd.randint(1, 20)
+            out.append(f'<p>{inner}</p>')
+        elif kind < 0.85:
+            out.append(f'<blockquote>{make_quoted_content(rnd, depth + 1)}</blockquote>')
+        elif kind < 0.9:
+            out.append('<blockquote>[...]</blockquote>')
+        else:
+            out.append(f'<div>{make_quoted_content(rnd, depth + 1)}</div>')
+    return ''.join(out)
+
+
+POST_WORDS = ['the', 'quick', 'brown', 'fox', 'patch', 'notes', 'star', 'citizen', 'bug', 'fix',
+              ':smile:', ':first_place_medal:', '&', '<', '>', 'é']
+POST_ORIGINS = [None, 'Forums', 'Twitter', 'CommLink', 'rsi', 'Bungie.net', 'Reddit', 'Steam']
+
+
+def make_post_content(rnd):
+    """ HTML content of a post, made of the blocks seen in the API feeds.
+    """
+    def text(nb_words):
+        return ' '.join(rnd.choice(POST_WORDS) for _ in range(nb_words))
+
+    def block():
+        kind = rnd.random()
+        if kind < 0.2:
+            return f'<p>{text(rnd.randint(3, 40))} <a href="https://example.com/{rnd.randint(1, 9)}">{text(2)}</a></p>'
+        if kind < 0.3:
+            return f'<p><b>{text(3)}</b> <i>{text(5)}</i> <u>{text(2)}</u></p>'
+        if kind < 0.4:
+            return '<ul>' + ''.join(f'<li>{text(rnd.randint(2, 10))}</li>' for _ in range(rnd.randint(1, 6))) + '</ul>'
+        if kind < 0.45:
+            return f'<img src="//media.example.com/{rnd.randint(1, 99)}.png"/>'
+        if kind < 0.5:
+            return '<img src="https://icon.example.com/e.gif"/>'
+        if kind < 0.55:
+            return f'<h2>{text(4)}</h2>'
+        if kind < 0.6:
+            return f'<pre><code>{text(6)}</code></pre>'
+        if kind < 0.65:
+            return '<br/><br/>\n\n<br/>'
+        if kind < 0.85:
+            paragraphs = ''.join(f'<p>{text(rnd.randint(5, 60))}</p>' for _ in range(rnd.randint(0, 6)))
+            author = rnd.choice(['<div class="quoteauthor">Bob said</div>', '<div class="bb_quoteauthor">Al</div>', ''])
+            return f'<blockquote>{author}{paragraphs or text(5)}</blockquote>'
+        return f'<p>{text(rnd.randint(1, 20))}</p>\n'
+
+    if rnd.random() < 0.15:
+        return text(rnd.randint(5, 80))
+    content = ''.join(block() for _ in range(rnd.choice([1, 3, 10, 40])))
+    if rnd.random() < 0.05:
+        content = f'<a href="\\"https://example.com/x\\""><b>{text(3)}</b></a> {content}'
+    return content
+
+
+RANDOM_TAGS = ['p', 'b', 'i', 'u', 'a', 'strong', 'em', 'span', 'div', 'blockquote', 'h1', 'h2', 'h3', 'ul', 'ol', 'li',
+               'code', 'kbd', 'del', 's', 'sub', 'sup', 'font', 'center', 'small', 'br', 'img', 'hr', 'pre', 'textarea']
+RANDOM_TEXTS = ['quick', 'brown', ' ', '  ', '\n', '\t', '*', '_', '1.', '2)', '#', '-', '>', '&amp;', '&lt;', '&gt;',
+                '&nbsp;', '&#39;', '&#x1F600;', '&foo;', '&amp', 'é', ':smile:', '[x]', '`', '\\', 'http://x.com/a_b',
+                '&#128;', '\xa0', '  \n ', '<!-- c -->', '<!---->']
+
+
+def make_random_html(rnd, depth=0):
+    """ Any mix of tags, attributes, entities and markdown characters, tags left open or badly closed included.
+    """
+    out = []
+    for _ in range(rnd.randint(0, 5)):
+        if rnd.random() < 0.45 or depth > 5:
+            out.append(''.join(rnd.choice(RANDOM_TEXTS) for _ in range(rnd.randint(1, 4))))
+            continue
+
+        tag = rnd.choice(RANDOM_TAGS)
+        attrs = _make_random_attrs(rnd, tag)
+        if tag in ('br', 'img', 'hr'):
+            out.append(rnd.choice([f'<{tag}{attrs}>', f'<{tag}{attrs}/>', f'<{tag}{attrs}></{tag}>']))
+            continue
+        close = rnd.choice([f'</{tag}>'] * 6 + ['', f'</{rnd.choice(RANDOM_TAGS)}>'])
+        out.append(f'<{tag}{attrs}>{make_random_html(rnd, depth + 1)}{close}')
+    return ''.join(out)
+
+
+def _make_random_attrs(rnd, tag):
+    attrs = []
+    if tag == 'a':
+        href = rnd.choice(['https://x.com/a', '"https://x.com/q"', 'http://x.com/a_b', '', None])
+        if href is not None:
+            attrs.append(f"href='{href}'")
+        if rnd.random() < 0.2:
+            attrs.append('title="t"')
+    if tag == 'div' and rnd.random() < 0.5:
+        attrs.append('class="' + rnd.choice(['quoteauthor', 'bb_quoteauthor', 'x quoteauthor', 'other']) + '"')
+    if tag == 'ol' and rnd.random() < 0.3:
+        attrs.append(f'start="{rnd.choice(["3", "x", ""])}"')
+    if tag == 'img':
+        attrs.append('src="' + rnd.choice(['//x/a.png', 'https://x/icon.gif', 'y.jpg']) + '"')
+    return ''.join(f' {attr}' for attr in attrs)
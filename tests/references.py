@@ -0,0 +1,87 @@
+# Previous implementations of optimized functions, the new ones must give the same output.
+# The benchmarks also use them as a baseline.
+import re
+
+from bs4 import BeautifulSoup, NavigableString
+
+
+def ellipsise_blockquotes(soup: BeautifulSoup, nb_char_overflow):
+    """ Blockquotes ellipsising loop of html_to_markdown() before renderer.ellipsise_blockquotes(),
+    it searches the blockquotes and paragraphs again after each removal.
+    """
+    if nb_char_overflow <= 0:
+        return
+
+    i = 0
+    bqs = soup.find_all('blockquote')
+    nb_char_stripped = 0
+    last_processed_bq = False
+
+    nb_blocquotes = len(bqs)
+    while i < nb_blocquotes and nb_char_overflow > nb_char_stripped:
+        bq = bqs[i]
+        init_bq_size = len(bq.text)
+        bq_ps = bq.find_all('p')
+
+        if len(bq_ps) < 2:
+
+            if len(bqs) < 1:
+                nb_blocquotes = 0
+                break
+
+            if bqs[-1].string == '[...]':
+                bqs[-1].decompose()
+                nb_blocquotes -= 1
+                nb_char_stripped += 5
+                bqs = soup.find_all('blockquote')
+                nb_blocquotes = len(bqs)
+            elif len(bqs) > 1:
+                ellipsis = soup.new_tag('blockquote')
+                ellipsis.string = '[...]'
+                nb_char_stripped += len(bqs[-1].text) - 5
+                bqs[-1].decompose()
+                bqs[-2].insert_after(ellipsis)
+                bqs = soup.find_all('blockquote')
+                nb_blocquotes = len(bqs)
+            elif len(bqs) == 1:
+                nb_char_stripped += len(bqs[-1].text)
+                bqs[-1].decompose()
+                bqs = soup.find_all('blockquote')
+                nb_blocquotes = 0
+                break
+            else:
+                break
+
+            continue
+
+        ellipsis = soup.new_tag('p')
+        ellipsis.string = '[...]'
+        bq_ps[-1].decompose()
+        bq_ps[-2].insert_after(ellipsis)
+        if len(bq_ps) > 2:
+            bq_ps[-1].decompose()
+            bq_ps[-2].decompose()
+            bq_ps[-3].insert_after(ellipsis)
+            nb_char_stripped += init_bq_size - len(bq.text)
+            last_processed_bq = bq
+        else:
+            i += 1
+            continue
+
+    if last_processed_bq:
+        last_p = last_processed_bq.find_all('p')[-1]
+        if last_p.text != '[...]':
+            if last_p.string:
+                last_p.string.replace_with('[...]')
+            else:
+                last_p.append(NavigableString('[...]'))
+
+
+def normalize_body(body):
+    """ Body post-processing of sanitize_post_content() before renderer.normalize_body(),
+    the whole body is rewritten until no run of four blockquote lines is left.
+    """
+    body_trimmed = re.sub(r'\n\s*\n', '\n\n', body)
+    while re.search(r'\n>\s*\n>\s*\n>\s*\n>', body_trimmed, re.MULTILINE):
+        body_trimmed = re.sub(r'\n>\s*\n>\s*\n>\s*\n>', '\n> \n> ', body_trimmed)
+    return re.sub(r'\n>\s*\n>\s*\n>', '\n> \n> ', body_trimmed)
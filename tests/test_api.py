@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+from cogs.utils import api
+from tests.payloads import make_posts_body
+
+
+def test_json_decoders_match():
+    body = make_posts_body(nb_posts=20, content_size=500)
+    expected = json.loads(body.decode())
+    assert api.get_json_loads('json')(body) == expected
+    assert api.get_json_loads('orjson')(body) == expected
+
+
+def test_json_decoder_fallback():
+    assert api.get_json_loads('json') is json.loads
+
+
+def test_posts_feed_decoded_lazily():
+    body = make_posts_body(nb_posts=10, content_size=200)
+    decoded = []
+
+    def loads(raw):
+        data = json.loads(raw)
+        decoded.extend(data['data'])
+        return data
+
+    feed = api.PostsFeed(body, loads)
+    assert len(feed) == 10
+    assert feed.ids[0] == 'post0'
+    assert feed.timestamps['post2'] == 1700000000 - 2 * 60
+    # Only the index and the raw body are kept, not the decoded posts
+    assert vars(feed) == {'_body': body, '_loads': loads, 'timestamps': feed.timestamps}
+
+    # Full posts are only decoded for the new ones
+    decoded.clear()
+    posts = feed.get_posts({'post3', 'post1'})
+    assert [p['id'] for p in posts] == ['post1', 'post3']
+    assert posts[0]['content'].startswith('<p>')
+    assert len(decoded) == 10
+
+    # The body is released, the index is kept
+    decoded.clear()
+    assert feed.get_posts({'post2'}) == []
+    assert not decoded
+    assert len(feed) == 10
+
+
+def test_posts_feed_released():
+    feed = api.PostsFeed(make_posts_body(nb_posts=10, content_size=200), json.loads)
+    feed.release()
+    assert feed.get_posts(set(feed.ids)) == []
+
+
+def test_get_cancelled_with_its_last_caller(monkeypatch):
+    requests = []
+
+    async def do_get(url, headers, timeout, raw):
+        requests.append(asyncio.current_task())
+        await asyncio.sleep(10)
+
+    async def run():
+        client = api.API()
+        monkeypatch.setattr(client, '_do_get', do_get)
+        first = asyncio.ensure_future(client._get('https://example.com/a'))
+        second = asyncio.ensure_future(client._get('https://example.com/a'))
+        await asyncio.sleep(0.01)
+        assert len(requests) == 1
+
+        # The request keeps running for the other caller
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not requests[0].done()
+
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert requests[0].cancelled()
+        assert not client._inflight and not client._inflight_waiters
+
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+import asyncio
+
+import aiosqlite
+import pytest
+
+from cogs.utils import database as db
+
+# Queries run with a key, and the index they must search with
+KEYED_QUERIES = [
+    ("SELECT post_id FROM posts WHERE game_id = ?;", 'PRIMARY KEY'),
+    ("SELECT game_id, post_id FROM posts WHERE game_id IN (?, ?, ?);", 'PRIMARY KEY'),
+    ("DELETE FROM posts WHERE game_id = ? AND post_id = ?;", 'PRIMARY KEY'),
+    ("UPDATE ignored_accounts SET service_id = ? WHERE account_id = ?;", 'idx_ignored_accounts_account_id'),
+    ("UPDATE allowed_accounts SET service_id = ? WHERE account_id = ?;", 'idx_allowed_accounts_account_id'),
+    ("SELECT account_id FROM ignored_accounts WHERE follower_guild_id = ? AND game_id = ? ;", 'sqlite_autoindex_ignored_accounts_1'),
+    ("DELETE FROM allowed_accounts WHERE follower_guild_id = ? AND game_id = ? AND account_id = ?;", 'sqlite_autoindex_allowed_accounts_1'),
+    ("SELECT * FROM follows WHERE follower_guild_id = ? AND followed_game_id = ?;", 'sqlite_autoindex_follows_1'),
+    ("UPDATE follows SET last_post_id = ? WHERE follower_guild_id = ? AND followed_game_id = ?;", 'sqlite_autoindex_follows_1'),
+    ("SELECT recent_posts FROM posts_watermarks WHERE game_id = ?;", 'sqlite_autoindex_posts_watermarks_1'),
+]
+
+
+async def query_plans(queries):
+    async with aiosqlite.connect(':memory:') as conn:
+        for statement in db.SCHEMA:
+            await conn.execute(statement)
+        await conn.commit()
+        await db.ORM()._migrate(conn)
+
+        plans = []
+        for query in queries:
+            nb_params = query.count('?')
+            async with conn.execute(f'EXPLAIN QUERY PLAN {query}', (None,) * nb_params) as cr:
+                plans.append([row[3] for row in await cr.fetchall()])
+        return plans
+
+
+@pytest.mark.parametrize('query, index', KEYED_QUERIES)
+def test_keyed_queries_use_index(query, index):
+    plan, = asyncio.run(query_plans([query]))
+    assert len(plan) == 1
+    assert plan[0].startswith('SEARCH')
+    assert index in plan[0]
+
+
+def test_migrations_version():
+    async def user_version():
+        async with aiosqlite.connect(':memory:') as conn:
+            for statement in db.SCHEMA:
+                await conn.execute(statement)
+            await db.ORM()._migrate(conn)
+            # Already applied migrations are skipped
+            await db.ORM()._migrate(conn)
+            async with conn.execute('PRAGMA user_version') as cr:
+                return (await cr.fetchone())[0]
+
+    assert asyncio.run(user_version()) == len(db.MIGRATIONS)
@@ -0,0 +1,90 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import random
+
+from bs4 import BeautifulSoup
+import pytest
+
+from cogs.utils import renderer
+from tests import references
+from tests.payloads import QUOTED_WORST_CASES, make_quoted_content
+
+POST = '<p>Patch <b>notes</b></p><blockquote>quoted</blockquote>'
+
+
+def test_render_replaces_broken_pool(monkeypatch):
+    monkeypatch.setattr(renderer, 'RENDER_POOL', 'process')
+    monkeypatch.setattr(renderer, 'RENDER_WORKERS', 1)
+
+    # A worker exiting abruptly breaks the whole pool
+    broken = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork'))
+    broken.submit(os._exit, 1).exception()
+    monkeypatch.setattr(renderer, '_executor', broken)
+
+    try:
+        rendered = asyncio.run(renderer._render(POST, None, False))
+        assert rendered == renderer.sanitize_post_content(POST)
+        assert renderer._executor not in (None, broken)
+    finally:
+        renderer.shutdown()
+
+
+def ellipsised(ellipsise, content, nb_char_overflow):
+    soup = BeautifulSoup(content, 'html.parser')
+    try:
+        ellipsise(soup, nb_char_overflow)
+    except ValueError as e:
+        # Both fail the same way on some trees, like an ellipsis inserted after a removed node
+        return repr(e)
+    return str(soup)
+
+
+@pytest.mark.parametrize('nb_char_overflow', [40, 10 ** 7])
+@pytest.mark.parametrize('name', QUOTED_WORST_CASES.keys())
+def test_ellipsise_blockquotes_worst_cases(name, nb_char_overflow):
+    content = QUOTED_WORST_CASES[name]
+    expected = ellipsised(references.ellipsise_blockquotes, content, nb_char_overflow)
+    assert ellipsised(renderer.ellipsise_blockquotes, content, nb_char_overflow) == expected
+
+
+def test_ellipsise_blockquotes_random_trees():
+    rnd = random.Random(0)
+    for _ in range(500):
+        content = make_quoted_content(rnd)
+        nb_char_overflow = rnd.choice([1, 5, 20, 50, 200, 10 ** 6])
+        expected = ellipsised(references.ellipsise_blockquotes, content, nb_char_overflow)
+        assert ellipsised(renderer.ellipsise_blockquotes, content, nb_char_overflow) == expected, content
+
+
+@pytest.mark.parametrize('body, expected', [
+    # Runs of empty blockquote lines, whatever their length
+    ('intro\n>\n>\nend', 'intro\n>\n>\nend'),
+    ('intro\n>\n>\n>\nend', 'intro\n> \n> \nend'),
+    ('intro\n>\n>\n>\n>\nend', 'intro\n> \n> \nend'),
+    ('intro\n>\n>\n>\n>\n>\nend', 'intro\n> \n> \nend'),
+    ('intro\n>\n>\n>\n>\n>\n>\n>\nend', 'intro\n> \n> \nend'),
+    # Any whitespace between the lines
+    ('a\n>\t\n> \r\n>\x0b\n>\xa0\n> b', 'a\n> \n>  b'),
+    ('a\n>\n\n>\n \n>\nb', 'a\n> \n> \nb'),
+    # Runs ending the body
+    ('text\n>\n>\n>', 'text\n> \n> '),
+    ('text\n>\n>\n>\n>\n>', 'text\n> \n> '),
+    # Blank lines
+    ('a\n\n\n\n> q\n\n\n> r', 'a\n\n> q\n\n> r'),
+    ('a \n \t\n\nb', 'a \n\nb'),
+    # Quoted text isn't collapsed
+    ('a\n>x\n>y\n>z\n>w\n>v', 'a\n>x\n>y\n>z\n>w\n>v'),
+])
+def test_normalize_body(body, expected):
+    assert references.normalize_body(body) == expected
+    assert renderer.normalize_body(body) == expected
+
+
+def test_normalize_body_random_bodies():
+    rnd = random.Random(0)
+    parts = ['\n', '>', '\n>', '\n> ', ' ', '\t', '\r', '\x0b', '\xa0', 'a', 'quote']
+    for _ in range(20000):
+        body = ''.join(rnd.choice(parts) for _ in range(rnd.randint(0, 30)))
+        assert renderer.normalize_body(body) == references.normalize_body(body), repr(body)
@@ -0,0 +1,110 @@
+import json
+from pathlib import Path
+import random
+
+from bs4 import BeautifulSoup
+import pytest
+
+from cogs.utils import renderer
+from cogs.utils import stream_renderer
+from tests.payloads import POST_ORIGINS, make_post_content, make_random_html
+
+FIXTURES = json.loads((Path(__file__).parent / 'fixtures' / 'posts.json').read_text())
+
+# Parity only holds with the versions the stream engine mirrors
+supported_versions = pytest.mark.skipif(bool(stream_renderer.UNSUPPORTED_VERSIONS), reason='Unsupported bs4 or markdownify version.')
+
+
+def prepare(content, origin):
+    """ Same preprocessing as sanitize_post_content(), before the HTML is rendered.
+    """
+    if origin not in ['Twitter', ]:
+        content = content.replace('\n', '')
+    return renderer.EM._replace_emoji_shortcodes(content)
+
+
+def render_stream(content, origin):
+    return stream_renderer.html_to_markdown(content, renderer.MD_CONVERTER, origin=origin, max_prettified_size=renderer.EMBEDS_MAX_DESC)
+
+
+def assert_parity(content, origin, strip_blockquotes):
+    """ Stream output must be the soup one, unless it declines to render the post. Returns whether it rendered it.
+    """
+    try:
+        rendered = render_stream(content, origin)
+    except stream_renderer.Unsupported:
+        return False
+    assert rendered == renderer.html_to_markdown(content, origin=origin, strip_blockquotes=strip_blockquotes), (origin, content)
+    return True
+
+
+@supported_versions
+@pytest.mark.parametrize('post', FIXTURES, ids=[post['name'] for post in FIXTURES])
+def test_fixtures_parity(post):
+    content = prepare(post['content'], post['origin'])
+    if post['fallback']:
+        with pytest.raises(stream_renderer.Unsupported):
+            render_stream(content, post['origin'])
+    else:
+        assert assert_parity(content, post['origin'], post['strip_blockquotes'])
+
+
+@pytest.mark.parametrize('post', FIXTURES, ids=[post['name'] for post in FIXTURES])
+def test_sanitize_post_content_engines(monkeypatch, post):
+    args = (post['content'], post['origin'], post['strip_blockquotes'])
+    monkeypatch.setattr(renderer, 'RENDER_ENGINE', 'soup')
+    expected = renderer.sanitize_post_content(*args)
+    monkeypatch.setattr(renderer, 'RENDER_ENGINE', 'stream')
+    assert renderer.sanitize_post_content(*args) == expected
+
+
+@supported_versions
+def test_generated_posts_parity():
+    rnd = random.Random(0)
+    nb_rendered = 0
+    for _ in range(200):
+        origin = rnd.choice(POST_ORIGINS)
+        content = prepare(make_post_content(rnd), origin)
+        nb_rendered += assert_parity(content, origin, rnd.random() < 0.3)
+    # Only the posts with long blockquotes fall back
+    assert nb_rendered > 150
+
+
+@supported_versions
+def test_random_html_parity():
+    rnd = random.Random(0)
+    nb_rendered = 0
+    for _ in range(2000):
+        origin = rnd.choice(POST_ORIGINS)
+        nb_rendered += assert_parity(prepare(make_random_html(rnd), origin), origin, rnd.random() < 0.3)
+    assert nb_rendered > 1000
+
+
+@supported_versions
+def test_prettified_size_bound():
+    rnd = random.Random(1)
+    contents = [make_post_content(rnd) for _ in range(100)] + [make_random_html(rnd) for _ in range(1000)]
+    for content in contents:
+        soup = BeautifulSoup(content, 'html.parser')
+        if not soup.find('blockquote'):
+            continue
+        parser = stream_renderer.StreamRenderer(renderer.MD_CONVERTER)
+        try:
+            parser.feed(content)
+            parser.close()
+        except stream_renderer.Unsupported:
+            continue
+        assert parser.max_prettified_size >= len(soup.prettify()), content
+
+
+@pytest.mark.parametrize('post', FIXTURES[:3], ids=[post['name'] for post in FIXTURES[:3]])
+def test_unsupported_versions_fall_back(monkeypatch, post):
+    monkeypatch.setattr(stream_renderer, 'UNSUPPORTED_VERSIONS', ['markdownify 0.0.1 (supported: 0.13.1)'])
+    with pytest.raises(stream_renderer.Unsupported):
+        render_stream(prepare(post['content'], post['origin']), post['origin'])
+
+    args = (post['content'], post['origin'], post['strip_blockquotes'])
+    monkeypatch.setattr(renderer, 'RENDER_ENGINE', 'soup')
+    expected = renderer.sanitize_post_content(*args)
+    monkeypatch.setattr(renderer, 'RENDER_ENGINE', 'stream')
+    assert renderer.sanitize_post_content(*args) == expected